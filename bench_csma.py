@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+
+import network as nw
+import protocol as pr
+import reporting as rp
+import replication as rep
+import sweep as sw
+
+#
+# benchmark: polling vs event-driven p-csma
+# counts the events processed by simpy and compares the network statistics of both
+# modes over several topologies and seeds
+# the event-driven mode checks the same slots, but wake-ups at the same instant can run
+# in a different order than with polling and then take each other's random numbers, so
+# runs are statistically equivalent, not identical; the paired differences of the
+# statistics should have confidence intervals around 0
+#
+
+# simulation settings
+simtime = 1000*60*60
+seed = 15
+runs = 5 # seeds per topology
+
+# network settings
+nw.SIGMA = 5
+
+nw.PTX = 12
+nw.SF = 7
+nw.CR = 4
+nw.BW = 125
+nw.FREQ = 900000000
+nw.TTL = 10
+
+# protocol settings
+pr.n0 = 5
+pr.HL = 10
+
+pr.rts = False
+
+# topologies; name -> (gateway location, end node locations)
+def topologies():
+    rs = np.random.RandomState(seed)
+    locs75 = np.loadtxt('75.csv',delimiter=',')
+    return {
+        '600x800': ((397.188492418693,226.186250701973),np.loadtxt('600x800.csv',delimiter=',')),
+        '75': ((0,0),locs75.T),
+        'random150': ((700,700),rs.uniform(0,1400,(149,2))),
+    }
+
+# environment counting processed events
+class countingEnv(nw.simpy.Environment):
+    def __init__(self):
+        super().__init__()
+        self.events = 0
+
+    def step(self):
+        self.events += 1
+        super().step()
+
+def run_exp(exp,gw,locs,seed,eventmac):
+    sim = nw.Simulation(seed,EXP=exp,EVENTMAC=eventmac)
+    sim.env = countingEnv()
+    sim.addNode(0,gw[0],gw[1]).genPacket(0,25,1)
+    for i in range(locs.shape[0]):
+        sim.addNode(i+1,locs[i,0],locs[i,1])
+    sim.start()
+    t0 = time.time()
+    sim.run(simtime)
+    wall = time.time() - t0
+    stats = [(n.arr,n.pkts,n.coll,n.miss,n.atte,n.relay,n.energy) for n in sim.nodes]
+    return sim.env.events,wall,stats,rp.summary(sim.nodes)
+
+# main
+if __name__ == '__main__':
+    for exp in [1,2]:
+        for name,(gw,locs) in topologies().items():
+            events = [0,0]
+            wall = [0,0]
+            same = 0
+            diff = {key: rep.myStat() for key in ['pdr','cr','energy']}
+            for i in range(runs):
+                s = sw.pointSeed(seed,i)
+                events0,wall0,stats0,summary0 = run_exp(exp,gw,locs,s,False)
+                events1,wall1,stats1,summary1 = run_exp(exp,gw,locs,s,True)
+                events[0] += events0
+                events[1] += events1
+                wall[0] += wall0
+                wall[1] += wall1
+                same += stats0 == stats1
+                for key in diff:
+                    diff[key].add(summary1[key] - summary0[key])
+            print('EXP ' + str(exp) + ', ' + name + ' (' + str(len(locs)+1) + ' nodes, ' + str(runs) + ' seeds):')
+            print('  polling:      ' + str(events[0]) + ' events, ' + str(round(wall[0],3)) + ' s')
+            print('  event-driven: ' + str(events[1]) + ' events, ' + str(round(wall[1],3)) + ' s')
+            print('  event reduction = ' + str(round(events[0]/events[1],2)) + 'x')
+            print('  identical runs = ' + str(same) + '/' + str(runs))
+            for key,stat in diff.items():
+                print('  ' + key + ' difference = ' + str(stat.mean) + ' +- ' + str(stat.halfWidth()))
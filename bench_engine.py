@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+
+import network as nw
+import engine as eg
+
+#
+# benchmark: simpy vs heap event kernel
+# compares raw events per second and the wall time of a full simulation; that both
+# kernels give identical results is checked by test_sim
+#
+
+# simulation settings
+simtime = 1000*60*60
+seed = 15
+
+# simulation parameters; the kernel is chosen per simulation (ENGINE)
+params = dict(EXP=1,SIGMA=5,PTX=12,SF=7,CR=4,BW=125,FREQ=900000000,TTL=10,n0=5,HL=5,rts=False)
+
+# no. of scheduled events of an environment of either kernel
+def scheduled(env):
+    if isinstance(env,eg.myEnvironment):
+        return next(env.eid)
+    return next(env._eid)
+
+# kernel only: processes polling every 500 ms like idle transceivers
+def run_kernel(engine,n=200):
+    env = nw.newEnv(engine)
+    def poll(env):
+        while True:
+            yield env.timeout(500)
+    for i in range(n):
+        env.process(poll(env))
+    t0 = time.time()
+    env.run(until=simtime)
+    return scheduled(env),time.time() - t0
+
+# full simulation
+def run_exp(engine):
+    sim = nw.Simulation(seed,ENGINE=engine,**params)
+
+    # base station initialization
+    locsB = np.array([397.188492418693,226.186250701973])
+    gw = sim.addNode(0,locsB[0],locsB[1])
+    gw.genPacket(0,25,1)
+
+    # end nodes initialization
+    locsN = np.loadtxt('600x800.csv',delimiter=',')
+    for i in range(0,locsN.shape[0]):
+        sim.addNode(i+1,locsN[i,0],locsN[i,1])
+
+    # run nodes
+    sim.start()
+    t0 = time.time()
+    sim.run(simtime) # start simulation
+    wall = time.time() - t0
+    return scheduled(sim.env),wall
+
+# main
+if __name__ == '__main__':
+    for engine in ['simpy','heap']:
+        events,wall = run_kernel(engine)
+        print(engine + ' kernel: ' + str(round(events/wall)) + ' events/s')
+    for engine in ['simpy','heap']:
+        events,wall = run_exp(engine)
+        print(engine + ' simulation: ' + str(events) + ' events, ' + str(round(wall,3)) + ' s')
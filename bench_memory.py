@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import tracemalloc
+import numpy as np
+
+import network as nw
+import protocol as pr
+
+#
+# benchmark: memory of packets on large topologies (tracemalloc)
+# measures the bytes held per packet when every node buffers a beacon and relay
+# copies of its neighbours' beacons, and the peak memory of a short simulation
+#
+
+# topology settings
+N = 5000 # no. of nodes in the packet test
+K = 10 # relay copies per node
+area = 10000 # side of the square in m
+seed = 15
+
+# simulation settings
+simN = 500 # no. of nodes in the simulation test
+simtime = 1000*60*10
+
+# network settings
+nw.SIGMA = 5
+
+nw.PTX = 12
+nw.SF = 7
+nw.CR = 4
+nw.BW = 125
+nw.FREQ = 900000000
+nw.TTL = 10
+
+# protocol settings
+pr.n0 = 5
+pr.HL = 5
+
+pr.rts = False
+
+def topology(sim,n):
+    rs = np.random.RandomState(seed)
+    gw = sim.addNode(0,area/2,area/2)
+    for i in range(1,n):
+        x,y = rs.uniform(0,area,2)
+        sim.addNode(i,x,y)
+    return gw
+
+# bytes per buffered packet (beacons and relay copies)
+def run_packets():
+    sim = nw.Simulation(seed,EXP=1)
+    topology(sim,N)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for node in sim.nodes:
+        node.genPacket(0,pr.plenC,1)
+    for i in range(N):
+        for k in range(1,K+1):
+            sim.nodes[i].relayPacket(sim.nodes[(i+k) % N].txBuffer[0])
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before,'filename'))
+    return size/(N*(K+1))
+
+# peak memory of a simulation, over its first and second half
+# flat in simulated time when the two are close
+def run_sim(exp):
+    tracemalloc.start()
+    sim = nw.Simulation(seed,EXP=exp,KSIGMA=3)
+    gw = topology(sim,simN)
+    gw.genPacket(0,25,1)
+    sim.start()
+    t0 = time.time()
+    sim.run(simtime/2)
+    current,peak1 = tracemalloc.get_traced_memory()
+    if hasattr(tracemalloc,'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # before Python 3.9; the second peak then only counts memory allocated after this
+        tracemalloc.stop()
+        tracemalloc.start()
+    sim.run(simtime)
+    wall = time.time() - t0
+    current,peak2 = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak1,peak2,wall
+
+# main
+if __name__ == '__main__':
+    print('packet: ' + str(round(run_packets())) + ' bytes')
+    for exp in [1,3]:
+        peak1,peak2,wall = run_sim(exp)
+        print('EXP ' + str(exp) + ' simulation of ' + str(simN) + ' nodes: peak ' + str(round(peak1/2**20,1)) + ' / ' + str(round(peak2/2**20,1)) + ' MiB, ' + str(round(wall,1)) + ' s')
@@ -3,10 +3,19 @@
 #
 
 # p-csma + dsdv / with memory
+# ids of rx nodes catch1 accounts for when they never received the packet
+def watch1(packet, txNode):
+    header = packet.header
+    nxt = txNode.rt.nextDict[header.dest]
+    if header.type == 0:
+        return [nxt]
+    return []
+
 def catch1(packet, txNode, rxNode, result):
-    if txNode.rt.nextDict[packet.dest] == rxNode.id and packet.type == 0:
+    header = packet.header
+    if txNode.rt.nextDict[header.dest] == rxNode.id and header.type == 0:
         if result:
-            packet.src.coll += result[0]
-            packet.src.miss += result[1]
+            header.src.coll += result[0]
+            header.src.miss += result[1]
         else:
-            packet.src.atte += 1
\ No newline at end of file
+            header.src.atte += 1
\ No newline at end of file
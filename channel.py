@@ -0,0 +1,243 @@
+import math
+import random
+import numpy as np
+
+from collections import OrderedDict
+
+#
+# CONSTANTS
+#
+
+# log-distance path loss model
+gamma = 2.75 # path loss exponent
+d0 = 1 # ref. distance in m
+PLd0 = 74.85 # mean path loss at d0
+GL = 0 # combined gain
+
+# topology cache
+DENSE = 2000 # max. no. of nodes for which the full distance/path loss matrices are built
+ROWS = 1024 # max. no. of cached rows (tx nodes) for larger topologies
+
+# shadowing sampler
+BLOCK = 1 << 12 # no. of normal draws generated at once per stream
+SHADOW = 0 # purpose key of the shadowing substreams
+
+#
+# k-sigma cutoff
+#
+# a rx node is only considered when its mean path loss is within k*sigma of the
+# link budget (txpow + GL - sensitivity); a pruned node would have received the
+# packet with probability less than Phi(-k)
+#
+
+# cutoff radius in m for the given link budget
+def radius(txpow,sens,sigma,k):
+    return d0*10**((txpow + GL - sens + k*sigma - PLd0)/(10*gamma))
+
+# upper bound of the reception probability of a pruned rx node
+def tailProb(k):
+    return 0.5*math.erfc(k/math.sqrt(2))
+
+#
+# uniform grid over node positions
+# cells are keyed by integer coordinates and hold lists of node indices
+#
+class myGrid():
+    def __init__(self,xs,ys,cell):
+        self.cell = cell
+        self.cells = {}
+        cxs = np.floor(xs/cell).astype(int).tolist()
+        cys = np.floor(ys/cell).astype(int).tolist()
+        for i in range(len(cxs)):
+            self.cells.setdefault((cxs[i],cys[i]),[]).append(i)
+
+    # indices of nodes in the cells overlapping the square of half-width r around (x,y)
+    def near(self,x,y,r):
+        found = []
+        for cx in range(math.floor((x-r)/self.cell),math.floor((x+r)/self.cell)+1):
+            for cy in range(math.floor((y-r)/self.cell),math.floor((y+r)/self.cell)+1):
+                found.extend(self.cells.get((cx,cy),()))
+        return np.array(found,dtype=int)
+
+#
+# block-generated shadowing with an independent NumPy substream per tx node
+# the k-th transmission of a node uses the k-th row of its stream, one column per
+# rx node, so a link's draw only depends on (seed, tx, k, rx) and not on event
+# ordering or on the order receivers are iterated
+# substreams are spawned from the seed with the key (purpose, tx index)
+#
+class myShadowing():
+    def __init__(self,seed,purpose=SHADOW):
+        self.seed = seed
+        self.purpose = purpose
+        self.streams = {} # tx index -> [generator, block, next row]
+
+    # next row of standard normal draws of the tx node's stream
+    # an empty row (no rx nodes) leaves the stream untouched
+    def draw(self,txIdx,width):
+        if width == 0:
+            return np.empty(0)
+        stream = self.streams.get(txIdx)
+        if stream is None:
+            seq = np.random.SeedSequence(self.seed,spawn_key=(self.purpose,txIdx))
+            stream = [np.random.Generator(np.random.PCG64(seq)),None,0]
+            self.streams[txIdx] = stream
+        block = stream[1]
+        # refill; rows are consecutive draws, so the block size does not change results
+        if block is None or stream[2] == block.shape[0] or block.shape[1] != width:
+            block = stream[0].standard_normal((max(1,BLOCK//width),width))
+            stream[1] = block
+            stream[2] = 0
+        row = block[stream[2]]
+        stream[2] += 1
+        return row
+
+#
+# channel engine holding node coordinates in arrays
+# rssi of a transmission is computed for all rx nodes in one call
+# results are addressed by node index, i.e. position in the node list (= node id)
+#
+# the deterministic part of the path loss only depends on the topology, so it is
+# computed once: as dense matrices for small networks, or row by row (per tx node,
+# least recently used rows dropped) for large ones
+# call invalidate() after nodes are added or moved
+#
+# shadowing is drawn from the simulation's random stream (historic results) unless
+# a seed is given for per-link NumPy streams; pass the sampler of the previous channel
+# when rebuilding for a grown node list, so that the streams continue
+#
+class myChannel():
+    def __init__(self,nodes,seed=None,rng=random,sampler=None):
+        self.nodes = nodes
+        self.seed = seed
+        self.rng = rng # random stream of the simulation
+        if sampler is None and seed is not None:
+            sampler = myShadowing(seed)
+        self.sampler = sampler
+        self.build()
+
+    # (re)read node coordinates and drop all cached distances/path losses
+    def build(self):
+        self.size = len(self.nodes)
+        self.xs = np.array([node.x for node in self.nodes],dtype=float)
+        self.ys = np.array([node.y for node in self.nodes],dtype=float)
+        self.distRows = OrderedDict() # tx index -> (dist row, mean path loss row)
+        self.grid = None # spatial index, built on first cutoff query
+        self.candDict = {} # (tx index,radius) -> rx candidates
+        self.pruned = 0 # rx nodes pruned by the cutoff, summed over transmissions
+        self.discarded = 0 # bound of the expected no. of receptions lost by pruning
+        self.pool = [] # free rssi buffers, see take
+        self.dense = self.size <= DENSE
+        if self.dense:
+            dist = np.sqrt((self.xs[:,None]-self.xs[None,:])**2+(self.ys[:,None]-self.ys[None,:])**2)
+            self.distMat = dist
+            self.PLMat = self.meanPL(dist)
+
+    # explicit invalidation; topology changed
+    def invalidate(self):
+        self.build()
+
+    # channel is built for this exact node list and shadowing seed
+    def valid(self,nodes,seed=None):
+        return self.nodes is nodes and self.size == len(nodes) and self.seed == seed
+
+    # mean path loss for given distances; inf at distance 0 (tx node itself)
+    @staticmethod
+    def meanPL(dist):
+        with np.errstate(divide='ignore'):
+            PL = PLd0 + 10*gamma*np.log10(dist/d0)
+        PL[dist == 0] = np.inf
+        return PL
+
+    # cached row of a tx node in the blocked (large topology) mode
+    def row(self,txIdx):
+        entry = self.distRows.get(txIdx)
+        if entry is None:
+            dist = np.sqrt((self.xs[txIdx]-self.xs)**2+(self.ys[txIdx]-self.ys)**2)
+            entry = (dist,self.meanPL(dist))
+            self.distRows[txIdx] = entry
+            if len(self.distRows) > ROWS:
+                self.distRows.popitem(last=False)
+        else:
+            self.distRows.move_to_end(txIdx)
+        return entry
+
+    # distance from tx node to all nodes
+    def distFrom(self,txIdx):
+        if self.dense:
+            return self.distMat[txIdx]
+        return self.row(txIdx)[0]
+
+    # mean path loss from tx node to all nodes; read-only
+    def PLFrom(self,txIdx):
+        if self.dense:
+            return self.PLMat[txIdx]
+        return self.row(txIdx)[1]
+
+    # mean path loss from tx node to the given nodes
+    def PLTo(self,txIdx,rx):
+        if self.dense:
+            return self.PLMat[txIdx,rx]
+        dist = np.sqrt((self.xs[txIdx]-self.xs[rx])**2+(self.ys[txIdx]-self.ys[rx])**2)
+        return self.meanPL(dist)
+
+    # all nodes but the tx node
+    def others(self,txIdx):
+        return np.delete(np.arange(self.size),txIdx)
+
+    # rx candidates within the cutoff radius, sorted by index
+    # pruned nodes are accounted with the tail probability of the k-sigma cutoff
+    def candidates(self,txIdx,radius,k):
+        key = (txIdx,radius)
+        rx = self.candDict.get(key)
+        if rx is None:
+            if self.grid is None:
+                self.grid = myGrid(self.xs,self.ys,radius)
+            near = self.grid.near(self.xs[txIdx],self.ys[txIdx],radius)
+            near = near[near != txIdx]
+            dist = np.sqrt((self.xs[txIdx]-self.xs[near])**2+(self.ys[txIdx]-self.ys[near])**2)
+            rx = np.sort(near[dist <= radius])
+            self.candDict[key] = rx
+        pruned = self.size - 1 - len(rx)
+        self.pruned += pruned
+        self.discarded += pruned*tailProb(k)
+        return rx
+
+    # shadowing of one transmission for the given no. of rx nodes
+    # the global stream is drawn in node order so that results match the per-node loop
+    def shadow(self,txIdx,sigma,width):
+        if self.sampler is None:
+            gauss = self.rng.gauss
+            return np.array([gauss(0,sigma) for _ in range(width)])
+        return sigma*self.sampler.draw(txIdx,width)
+
+    # rssi at all nodes; -inf at the tx node itself
+    # only shadowing is added per packet
+    # when rx candidates are given, only those get a channel realization; -inf elsewhere
+    # out - buffer to write into, e.g. from the pool (see take)
+    def rssi(self,txIdx,txpow,sigma,rx=None,out=None):
+        if rx is None:
+            if self.sampler is None:
+                shadow = np.insert(self.shadow(txIdx,sigma,self.size-1),txIdx,0.0)
+            else:
+                shadow = self.shadow(txIdx,sigma,self.size) # one column per node, tx column unused
+            return np.subtract(txpow + GL,self.PLFrom(txIdx) + shadow,out=out)
+        rssi = np.full(self.size,-np.inf) if out is None else out
+        if out is not None:
+            rssi.fill(-np.inf)
+        rssi[rx] = self.rssiTo(txIdx,txpow,sigma,rx)
+        return rssi
+
+    # rssi at the rx candidates only, in the order of rx
+    def rssiTo(self,txIdx,txpow,sigma,rx):
+        return txpow + GL - (self.PLTo(txIdx,rx) + self.shadow(txIdx,sigma,len(rx)))
+
+    # full-size rssi buffer of one transmission; reused once given back
+    def take(self):
+        if self.pool:
+            return self.pool.pop()
+        return np.empty(self.size)
+
+    def give(self,buffer):
+        if len(buffer) == self.size:
+            self.pool.append(buffer)
@@ -0,0 +1,102 @@
+import heapq
+
+from itertools import count
+
+#
+# lightweight discrete event kernel
+# drop-in for the subset of simpy.Environment used by the simulator
+# (now, event, timeout, process, run); processes are plain generators, entries are
+# ordered by (time, priority, event id) like simpy, so a run is event-for-event
+# identical to the simpy reference
+#
+# a timeout is not an event object: env.timeout returns a (time, event id, value)
+# tuple, and the process yielding it puts itself on the queue; it can only be waited
+# on by yielding it from one process, which is all the simulator does
+# the queue holds (time, priority, event id, target, value) entries, target being an
+# event or a process, and the kernel calls target.fire(value)
+#
+
+# priorities
+URGENT = 0
+NORMAL = 1
+
+class myEvent():
+    __slots__ = ('env','callbacks','value')
+
+    def __init__(self,env):
+        self.env = env
+        self.callbacks = [] # called with the event when it is processed
+        self.value = None
+
+    # trigger now; callbacks run when the event is processed
+    def succeed(self,value=None):
+        self.value = value
+        self.env.schedule(self,NORMAL,0)
+        return self
+
+    def fire(self,value):
+        callbacks = self.callbacks
+        self.callbacks = None
+        for callback in callbacks:
+            callback(self)
+
+class myProcess():
+    __slots__ = ('gen','queue','callback')
+
+    def __init__(self,env,gen):
+        self.gen = gen
+        self.queue = env.queue
+        self.callback = self.wake # bound once, appended to every awaited event
+        env.schedule(self,URGENT,0)
+
+    # send value to the generator, then wait for what it yields next
+    def fire(self,value):
+        try:
+            target = self.gen.send(value)
+        except StopIteration:
+            return
+        if type(target) is tuple:
+            heapq.heappush(self.queue,(target[0],NORMAL,target[1],self,target[2]))
+        else:
+            target.callbacks.append(self.callback)
+
+    # awaited event processed
+    def wake(self,event):
+        self.fire(event.value)
+
+class myEnvironment():
+    def __init__(self,initial_time=0):
+        self.now = initial_time
+        self.queue = [] # heap of (time, priority, event id, target, value)
+        self.eid = count()
+
+    def schedule(self,target,priority,delay,value=None):
+        heapq.heappush(self.queue,(self.now + delay,priority,next(self.eid),target,value))
+
+    def event(self):
+        return myEvent(self)
+
+    # to be yielded by a process; the event id is taken now, as simpy does
+    def timeout(self,delay,value=None):
+        return (self.now + delay,next(self.eid),value)
+
+    def process(self,gen):
+        return myProcess(self,gen)
+
+    # process events until the queue is empty or time until is reached
+    # until must lie after the current time, as in simpy
+    def run(self,until=None):
+        stop = None
+        if until is not None:
+            if until <= self.now:
+                raise ValueError('until (' + str(until) + ') must be greater than the current simulation time')
+            stop = myEvent(self)
+            self.schedule(stop,URGENT,until - self.now)
+        queue = self.queue
+        pop = heapq.heappop
+        while queue:
+            now,_,_,target,value = pop(queue)
+            self.now = now
+            if target is stop:
+                break
+            target.fire(value)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import network as nw
+import protocol as pr
+import reporting as rp
+import replication as rep
+
+#
+# "main" program
+# exp1 replicated until the 95% confidence intervals are narrow enough
+#
+
+# simulation settings
+simtime = 5*1000*60*60
+seed = 15 # base seed; replication i gets sweep.pointSeed(seed,i)
+
+# replication settings
+target = {'pdr': 0.02, 'cr': 0.02, 'energy': 0.5} # half-widths; energy in J
+maxRuns = 50
+
+# network settings
+nw.EXP = 1
+nw.SIGMA = 5
+
+nw.PTX = 12
+nw.SF = 7
+nw.CR = 4
+nw.BW = 125
+nw.FREQ = 900000000
+nw.TTL = 10
+
+# protocol settings
+pr.n0 = 5
+pr.RM1 = 0
+pr.RM2 = 0
+pr.QTH = 5*60*1000
+pr.HL = 5
+
+pr.rts = False
+
+def run_exp(seed):
+    sim = nw.Simulation(seed)
+
+    # base station initialization
+    locsB = np.array([397.188492418693,226.186250701973])
+    gw = sim.addNode(0,locsB[0],locsB[1])
+    gw.genPacket(0,25,1)
+
+    # end nodes initialization
+    locsN = np.loadtxt('600x800.csv',delimiter=',')
+    for i in range(0,locsN.shape[0]):
+        sim.addNode(i+1,locsN[i,0],locsN[i,1])
+
+    # run nodes
+    sim.start()
+    sim.run(simtime) # start simulation
+    return rp.summary(sim.nodes)
+
+# main
+if __name__ == '__main__':
+    stats,results = rep.run(run_exp,target,seed,maxRuns=maxRuns)
+    print('Replications = ' + str(len(results)))
+    for name in ['pdr','ar','cr','mr','energy']:
+        print(name + ' = ' + str(stats[name].mean) + ' +- ' + str(stats[name].halfWidth()))
@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import random
-import csv
-
 import network as nw
 import protocol as pr
+import sweep as sw
+import routing as ro
 
 #
 # "main" program
@@ -18,7 +17,7 @@ relay_only = 0
 
 # simulation settings
 simtime = 1000*60*60
-random.seed(15)
+seed = 15 # base seed; each point gets its own, see sweep.pointSeed
 
 # network settings
 
@@ -40,48 +39,35 @@ pr.HL = 5
 
 pr.rts = False
 
-def run_exp(n):
-    nw.nodes = []
-    nw.env = nw.simpy.Environment()
+def run_exp(n,seed):
+    sim = nw.Simulation(seed,avgGenTime=1000*n)
 
     # base station initialization
-    gw = nw.myNode(0, 0, 0)
-    nw.nodes.append(gw)
-
-    pr.avgGenTime = 1000*n
+    sim.addNode(0, 0, 0)
 
     # end nodes initialization
     for i in range(1, 11):
-        node = nw.myNode(i, i*D/10, 0)
-        # set routing table
-        node.rt.destSet.add(0)
-        node.rt.nextDict[0] = i-1
-        node.rt.metricDict = i # hops
-        node.rt.seqDict = 0
-        nw.nodes.append(node)
+        node = sim.addNode(i, i*D/10, 0)
+        # set routing table; chain to the gateway, i hops
+        ro.install(node,0,i-1,i,0)
 
     # run nodes
-    for i in range(0,len(nw.nodes)):
-        nw.env.process(nw.transceiver(nw.env,nw.nodes[i]))
-        if (not relay_only) and i > 0:
-            nw.env.process(nw.generator(nw.env,nw.nodes[i]))
     if relay_only:
-        nw.env.process(nw.generator(nw.env,nw.nodes[10]))      
-    nw.env.run(until=simtime) # start simulation
-    return nw.nodes
+        sim.start(gens=[10])
+    else:
+        sim.start()
+    sim.run(simtime) # start simulation
+
+    node = sim.nodes[-1]
+    pdr = node.arr/node.pkts
+    ar = node.atte/node.pkts
+    cr = node.coll/(node.pkts-node.atte)
+    mr = node.miss/(node.pkts-node.atte)
+    return [node.x, n, pdr, ar, cr, mr, node.energy]
 
 # main
-with open('linear_interval.csv', 'w', newline='') as file:
-    writer = csv.writer(file)
-    writer.writerow(["dist", "interval", "pdr", "ar", "cr", "mr", "energy"])
-    for interval in range(1, N+1):
-        nodes = run_exp(interval)
-        node = nodes[-1]
-        pdr = node.arr/node.pkts
-        ar = node.atte/node.pkts
-        cr = node.coll/(node.pkts-node.atte)
-        mr = node.miss/(node.pkts-node.atte)
-        writer.writerow([node.x, interval, pdr, ar, cr, mr, node.energy])
+if __name__ == '__main__':
+    sw.run(run_exp, list(range(1, N+1)), 'linear_interval.csv', ["dist", "interval", "pdr", "ar", "cr", "mr", "energy"], seed)
 
 
 
@@ -2,9 +2,20 @@ import simpy
 import random
 import numpy as np
 import math
+import bisect
+import sys
+import copy
+import pickle
+
+from functools import lru_cache
+from itertools import count
+from operator import attrgetter
 
 import protocol as pr
-import catchloss as cl
+import channel as ch
+import engine as eg
+import steady as st
+import routing as ro
 
 #
 # CONTANTS
@@ -24,6 +35,30 @@ TTL = 4
 # shadowing
 SIGMA = 11.25
 
+# seed of the per-link NumPy shadowing streams, see channel.py
+# None to draw from the global random stream (reproduces historic results)
+SHADOWSEED = None
+
+# event kernel; 'simpy' (reference) or 'heap' (lightweight kernel in engine.py)
+ENGINE = 'simpy'
+
+# event-driven p-csma; idle nodes block on events instead of polling every slot
+# call settle() after env.run to account the rx time of idle nodes (done by Simulation.run)
+# statistically equivalent to polling, not identical; see idle
+EVENTMAC = False
+
+# k-sigma cutoff for rx candidates, see channel.py; None to consider all nodes
+KSIGMA = None
+
+# keep the routing tables in network-wide arrays, see routing.myRouteStore
+# node ids must then be 0..N-1
+ARRAYRT = False
+
+# keep the counters, energy and mode of nodes added by Simulation.addNode in
+# network-wide arrays, see myNodeState; node ids must then be 0..N-1
+# vectorizes the statistics, at the price of slower per-node updates during the run
+ARRAYSTATE = False
+
 # this is an array with measured values for sensitivity
 # see paper, Table 3
 sf7 = np.array([7, -126.5, -124.25, -120.75])
@@ -47,8 +82,265 @@ V = 3.0     # voltage XXX
 # global stuff
 #
 
+# new environment of the given event kernel, defaults to ENGINE
+def newEnv(engine=None,now=0):
+    if engine is None:
+        engine = ENGINE
+    if engine == 'simpy':
+        return simpy.Environment(now)
+    elif engine == 'heap':
+        return eg.myEnvironment(now)
+    raise ValueError('engine ' + str(engine) + ' is not defined')
+
 nodes = []
-env = simpy.Environment()
+env = newEnv()
+chan = None # channel engine, built lazily for the current node list
+
+#
+# simulation
+#
+
+# parameters owned by a simulation; defaults are the network/protocol module constants
+NETPARAMS = ('EXP','PTX','SF','CR','BW','FREQ','TTL','SIGMA','SHADOWSEED','KSIGMA','EVENTMAC','ENGINE','ARRAYRT','ARRAYSTATE')
+PRPARAMS = ('rts','n0','p0','RM1','RM2','HL','avgGenTime','plenA','plenB','plenC')
+
+#
+# a simulation owns its environment, node list, random stream and PHY/protocol
+# parameters; nodes, packets and the transceiver process are bound to it, so
+# several simulations can run in one process
+#
+class Simulation():
+    def __init__(self,seed=None,**params):
+        # p-csma possibility follows the assumed no. of neighbours unless given
+        if 'n0' in params and 'p0' not in params:
+            params['p0'] = (1-(1/params['n0']))**(params['n0']-1)
+        for name in NETPARAMS:
+            setattr(self,name,params.pop(name,globals()[name]))
+        for name in PRPARAMS:
+            setattr(self,name,params.pop(name,getattr(pr,name)))
+        if params:
+            raise ValueError('parameter ' + ', '.join(params) + ' is not defined')
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.env = newEnv(self.ENGINE)
+        self.nodes = []
+        self.chan = None # channel engine, built lazily for the current node list
+        self.nodeIndex = None # (node list, size, id -> node), built lazily
+        self.forest = ro.myForest() # next hop forest of the routing tables, see myRT.setRoute
+        self.store = None # array routing tables (ARRAYRT), built on the first node
+        self.state = None # array node state (ARRAYSTATE), built on the first node
+
+    # create a node bound to this simulation; node ids are expected to match list positions
+    def addNode(self,id,x,y):
+        node = myStateNode(id,x,y,self) if self.ARRAYSTATE else myNode(id,x,y,self)
+        self.nodes.append(node)
+        return node
+
+    # start the transceivers of all nodes and the packet generators of the given node ids
+    # (default: all end devices); processes are created node by node
+    def start(self,gens=None):
+        for node in self.nodes:
+            node.wake = ('start',next(wakeSeq))
+            self.env.process(transceiver(self.env,node))
+            if (node.id > 0) if gens is None else (node.id in gens):
+                node.genWake = ('start',next(wakeSeq))
+                self.env.process(generator(self.env,node))
+
+    def run(self,until):
+        self.env.run(until=until)
+        if self.EVENTMAC:
+            self.settle()
+
+    # install converged dsdv tables computed from the mean link quality instead of
+    # simulating beacon convergence; see routing.preseed
+    # dests - destinations (default: gateway)
+    # margin - min. mean rssi above sensitivity of a usable link in dB
+    # hl - max. no. of hops (default: HL of the simulation)
+    # return no. of nodes without a route, summed over destinations
+    def preseed(self,dests=None,margin=0,hl=None):
+        if hl is None:
+            hl = self.HL
+        sensitivity = sensi[self.SF - 7, [125,250,500].index(self.BW) + 1]
+        return ro.preseed(self.nodes,self.getChannel(),self.PTX,sensitivity,dests,margin,hl)
+
+    # checkpoint of the full state at the current time, see mySnapshot
+    def snapshot(self):
+        return mySnapshot(self)
+
+    # run until the steady state is estimated precisely enough, at most until time until
+    # warm-up is detected and discarded; see steady.run for the options
+    def runSteady(self,until,**options):
+        return st.run(self,until,**options)
+
+    # node with the given id, None if there is none; index rebuilt when the list is replaced or grows
+    def getNode(self,id):
+        index = self.nodeIndex
+        if index is None or index[0] is not self.nodes or index[1] != len(self.nodes):
+            index = (self.nodes,len(self.nodes),{node.id: node for node in self.nodes})
+            self.nodeIndex = index
+        return index[2].get(id)
+
+    # network-wide routing store (ARRAYRT)
+    def getStore(self):
+        if self.store is None:
+            self.store = ro.myRouteStore()
+        return self.store
+
+    # network-wide node state (ARRAYSTATE)
+    def getState(self):
+        if self.state is None:
+            self.state = myNodeState()
+        return self.state
+
+    # copy of the counters of all nodes at the current time (ARRAYSTATE)
+    # one row per field of myNodeState.FIELDS, one column per node id
+    def counters(self):
+        if not self.ARRAYSTATE:
+            raise ValueError('counters need a simulation with ARRAYSTATE')
+        if self.EVENTMAC:
+            self.settle()
+        state = self.getState()
+        return state.block[:,:state.size].copy()
+
+    # channel engine of the node list; rebuilt when the list is replaced or grows
+    # the shadowing streams continue when the same list grows
+    def getChannel(self,nodes=None):
+        if nodes is None:
+            nodes = self.nodes
+        chan = self.chan
+        if chan is None or not chan.valid(nodes,self.SHADOWSEED):
+            sampler = None
+            if chan is not None and chan.nodes is nodes and chan.seed == self.SHADOWSEED:
+                sampler = chan.sampler
+            self.chan = ch.myChannel(nodes,self.SHADOWSEED,self.rng,sampler)
+        return self.chan
+
+    # drop cached distances/path losses; call after nodes are added or moved
+    def invalidateChannel(self):
+        if self.chan is not None:
+            self.chan.invalidate()
+
+    # account the rx time of nodes still blocked in idle (EVENTMAC)
+    def settle(self):
+        for node in self.nodes:
+            if node.idleSlot is not None:
+                catchUp(node,self.env.now)
+
+#
+# compatibility shim for scripts that set the module constants and globals
+# (nw.EXP, nw.nodes, nw.env, pr.RM1, ...) and seed the global random stream;
+# all parameters and state read and write through to the modules
+#
+class moduleSimulation(Simulation):
+    rng = random
+    seed = None
+
+    def __init__(self):
+        self.nodeIndex = None
+        self.forestNodes = None # node list the forest was built for
+        self.runForest = None
+        self.store = None
+        self.state = None
+
+    # scripts replace nw.nodes between runs; the forest (and node index) follow it
+    # the forest is rebuilt from the tables of the nodes in the new list
+    @property
+    def forest(self):
+        if self.forestNodes is not nodes:
+            self.forestNodes = nodes
+            self.nodeIndex = None
+            self.runForest = ro.myForest()
+            self.runForest.rebuild(nodes)
+        return self.runForest
+
+def moduleProperty(module,name):
+    return property(lambda self: getattr(module,name),lambda self,value: setattr(module,name,value))
+
+for name in NETPARAMS + ('env','nodes','chan'):
+    setattr(moduleSimulation,name,moduleProperty(sys.modules[__name__],name))
+for name in PRPARAMS:
+    setattr(moduleSimulation,name,moduleProperty(pr,name))
+
+# simulation of nodes created without one
+moduleSim = moduleSimulation()
+
+#
+# checkpoint of a simulation
+# holds a copy of the nodes (routing tables, rssi records, buffers, counters),
+# the channel, the parameters and the random streams; pending events are kept as
+# the wake-ups recorded by the processes (see transceiver) and recreated on restore,
+# so a restored simulation continues exactly like the original one
+# used to warm-start runs from a converged network instead of repeating the warm-up
+#
+class mySnapshot():
+    def __init__(self,sim):
+        if isinstance(sim,moduleSimulation):
+            raise ValueError('snapshot needs a Simulation, not the module globals')
+        self.time = sim.env.now
+        # kernel events are recreated on restore
+        env = sim.env
+        events = [(node.txEvent,node.rxBuffer.clearEvent) for node in sim.nodes]
+        sim.env = None
+        for node in sim.nodes:
+            node.txEvent = None
+            node.rxBuffer.clearEvent = None
+        try:
+            self.sim = copy.deepcopy(sim)
+        finally:
+            sim.env = env
+            for node,(txEvent,clearEvent) in zip(sim.nodes,events):
+                node.txEvent = txEvent
+                node.rxBuffer.clearEvent = clearEvent
+
+    # new simulation continuing from the snapshot; may be called repeatedly
+    # seed - reseed the random stream for an independent continuation
+    # params - simulation parameters to change for the continuation, e.g. avgGenTime
+    def restore(self,seed=None,**params):
+        sim = copy.deepcopy(self.sim)
+        if 'n0' in params and 'p0' not in params:
+            params['p0'] = (1-(1/params['n0']))**(params['n0']-1)
+        for name,value in params.items():
+            if name not in NETPARAMS + PRPARAMS:
+                raise ValueError('parameter ' + name + ' is not defined')
+            setattr(sim,name,value)
+        if 'EXP' in params:
+            for node in sim.nodes:
+                node.proto = None
+        if seed is not None:
+            sim.seed = seed
+            sim.rng = random.Random(seed)
+            if sim.chan is not None:
+                sim.chan.rng = sim.rng
+        sim.env = newEnv(sim.ENGINE,self.time)
+        # recreate processes in the order their wake-ups were scheduled
+        pending = []
+        for node in sim.nodes:
+            for wake,process in [(node.wake,transceiver),(node.genWake,generator)]:
+                if wake is not None:
+                    t = wake[1] if wake[0] in ['wait','air'] else self.time
+                    seq = wake[2] if wake[0] in ['wait','air'] else wake[1]
+                    pending.append((t,seq,process,node,wake))
+        pending.sort(key=lambda p: p[:2])
+        for t,seq,process,node,wake in pending:
+            sim.env.process(process(sim.env,node,None if wake[0] == 'start' else wake))
+        return sim
+
+    def save(self,filename):
+        with open(filename,'wb') as file:
+            pickle.dump(self,file)
+
+    @staticmethod
+    def load(filename):
+        with open(filename,'rb') as file:
+            return pickle.load(file)
+
+# channel engine of the node list, see Simulation.getChannel
+def getChannel(nodes):
+    return moduleSim.getChannel(nodes)
+
+# drop cached distances/path losses; call after nodes are added or moved
+def invalidateChannel():
+    moduleSim.invalidateChannel()
 
 #
 # network structures
@@ -59,8 +351,10 @@ env = simpy.Environment()
 def checkcollision(packet,rxNode):
     col = 0 # flag needed since there might be several collisions for packet
     if rxNode.rxBuffer: # if there is a packet on air
-        for i in range(len(rxNode.rxBuffer)):
-            other = rxNode.rxBuffer[i][0]
+        # only packets on interfering channels that end after the critical section
+        header = packet.header
+        for entry in rxNode.rxBuffer.interferers(packet,packet.appearTime + preambTime(header.sf,header.bw)):
+            other = entry[0]
             if other != packet:
                 # simple collision
                 if frequencyCollision(packet,other) and sfCollision(packet,other) and timingCollision(packet,other):
@@ -70,8 +364,8 @@ def checkcollision(packet,rxNode):
                     # either this one, the other one, or both
                     for p in c:
                         if p == other:
-                            rxNode.rxBuffer[i][1] = 1 # set collide flag for entry in rxBuffer
-                            # raise ValueError('Collision happened for pkt from ' + str(rxNode.rxBuffer[i][0].txNode.id) + ' and ' + str(packet.txNode.id) + ' to ' + str(rxNode.id))
+                            entry[1] = 1 # set collide flag for entry in rxBuffer
+                            # raise ValueError('Collision happened for pkt from ' + str(entry[0].txNode.id) + ' and ' + str(packet.txNode.id) + ' to ' + str(rxNode.id))
                         if p == packet:
                             col = 1
                 else:
@@ -86,6 +380,8 @@ def checkcollision(packet,rxNode):
 #        |f1-f2| <= 60 kHz if f1 or f2 has bw 250
 #        |f1-f2| <= 30 kHz if f1 or f2 has bw 125
 def frequencyCollision(p1,p2):
+    p1 = p1.header
+    p2 = p2.header
     if (abs(p1.freq-p2.freq)<=120) and (p1.bw==500 or p2.freq==500):
         # print("frequency coll 500")
         return True
@@ -99,7 +395,7 @@ def frequencyCollision(p1,p2):
     return False
 
 def sfCollision(p1,p2):
-    if p1.sf == p2.sf:
+    if p1.header.sf == p2.header.sf:
         # print("collision sf node {} and node {}".format(p1.id, p2.id))
         # p2 may have been lost too, will be marked by other checks
         return True
@@ -109,8 +405,8 @@ def sfCollision(p1,p2):
 def powerCollision(p1,p2,rxNode):
     powerThreshold = 6 # dB
     # print("pwr: node {0.nodeid} {0.rssi:3.2f} dBm node {1.nodeid} {1.rssi:3.2f} dBm; diff {2:3.2f} dBm".format(p1, p2, round(p1.rssi - p2.rssi,2)))
-    rssi_p1 = p1.rssiAt[rxNode]
-    rssi_p2 = p2.rssiAt[rxNode]
+    rssi_p1 = p1.rssiAt[rxNode.id]
+    rssi_p2 = p2.rssiAt[rxNode.id]
     if abs(rssi_p1 - rssi_p2) < powerThreshold:
         # print("collision pwr both node {} and node {}".format(p1.nodeid, p2.nodeid))
         # packets are too close to each other, both collide
@@ -129,15 +425,12 @@ def timingCollision(p1,p2):
     # we've already determined that p1 is a weak packet, so the only
     # way we can win is by being late enough (only the first n - 5 preamble symbols overlap)
 
-    # assuming 8 preamble symbols
-    Npream = 8
-
-    # we can lose at most (Npream - 5) * Tsym of our preamble; symbol time Tsym = (2.0**sf)/bw
-    Tpreamb = 2**p1.sf/(1.0*p1.bw) * (Npream - 5) # minimum preamble time
+    # minimum preamble time, looked up by (sf,bw)
+    Tpreamb = preambTime(p1.header.sf,p1.header.bw)
 
     # check whether p2 ends in p1's critical section
-    p2_end = p2.appearTime + p2.airtime() # the time when p2 appeared + the airtime of p2
-    p1_cs = env.now + Tpreamb
+    p2_end = p2.endTime # the time when p2 appeared + the airtime of p2
+    p1_cs = p1.appearTime + Tpreamb # p1 appears now
     # print("collision timing node {} ({},{},{}) node {} ({},{})".format(
     #     p1.nodeid, env.now - env.now, p1_cs - env.now, p1.airtime,
     #     p2.nodeid, p2.addTime - env.now, p2_end - env.now
@@ -149,14 +442,84 @@ def timingCollision(p1,p2):
     # print("saved by the preamble")
     return False
 
+#
+# receive buffer of a node
+# entries [packet,collision flag,miss flag] are bucketed by channel (freq,sf) and
+# kept ordered by the end time of the packet within a bucket
+# entries are also indexed by packet for delivery lookup
+#
+class myRxBuffer():
+    # max. frequency offset for which packets can collide, see frequencyCollision
+    FBAND = 120
+
+    def __init__(self):
+        self.buckets = {} # (freq,sf) -> [end times, entries]
+        self.index = {} # packet -> entry
+        self.clearEvent = None # triggered when the buffer becomes empty (event-driven mac)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        for bucket in list(self.buckets.values()):
+            for entry in bucket[1]:
+                yield entry
+
+    # add entry of a transmitted packet
+    def append(self,entry):
+        packet = entry[0]
+        header = packet.header
+        key = (header.freq,header.sf)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [[],[]]
+            self.buckets[key] = bucket
+        i = bisect.bisect_right(bucket[0],packet.endTime)
+        bucket[0].insert(i,packet.endTime)
+        bucket[1].insert(i,entry)
+        self.index[packet] = entry
+
+    # remove and return the entry of packet; None if not buffered
+    def pop(self,packet):
+        entry = self.index.pop(packet,None)
+        if entry is None:
+            return None
+        header = packet.header
+        key = (header.freq,header.sf)
+        ends,entries = self.buckets[key]
+        i = bisect.bisect_left(ends,packet.endTime)
+        while entries[i] is not entry:
+            i += 1
+        del ends[i]
+        del entries[i]
+        if not entries:
+            del self.buckets[key]
+        if not self.index and self.clearEvent is not None:
+            event = self.clearEvent
+            self.clearEvent = None
+            event.succeed()
+        return entry
+
+    # entries on channels that can interfere with packet and ending after time t
+    def interferers(self,packet,t):
+        found = []
+        header = packet.header
+        for (freq,sf),(ends,entries) in self.buckets.items():
+            if sf == header.sf and abs(freq-header.freq) <= self.FBAND:
+                found.extend(entries[bisect.bisect_right(ends,t):])
+        return found
+
 #
 # this function creates a node
 #
 class myNode():
-    def __init__(self,id,x,y):
+    STATEFUL = False # counters in the node state of the simulation, see myStateNode
+
+    def __init__(self,id,x,y,sim=None):
         self.id = id # negative for base station
         self.x = x
         self.y = y
+        self.sim = sim if sim is not None else moduleSim
 
         self.mode = 1 # 0-sleep; 1-rx; 2-tx
         self.modeStart = 0 # start time of the current mode
@@ -175,26 +538,28 @@ class myNode():
         self.arr = 0 # packets arrive at destination
 
         # FIFO lists
-        self.rxBuffer = [] # list of tuples in the form (packet,collision flag,miss flag)
+        self.rxBuffer = myRxBuffer() # entries in the form [packet,collision flag,miss flag]
         self.txBuffer = []
+        self.txEvent = None # triggered when txBuffer becomes non-empty (event-driven mac)
+        self.idleSlot = None # [next slot, slot length] while blocked in idle
+        self.wake = None # pending wake-up of the transceiver, see transceiver
+        self.genWake = None # pending wake-up of the generator
         
         self.rt = self.myRT(self) # routing table
+        self.proto = None # protocol bundle, see getProtocol
     
     # remove packet from rxBuffer; return [col,mis]
     def checkDelivery(self,packet):
-        for i in range(len(self.rxBuffer)):
-            other = self.rxBuffer[i]
-            if other[0] == packet:
-                entry = self.rxBuffer.pop(i)
-                return entry[1:] # break loop, remove only one
-        return []
+        entry = self.rxBuffer.pop(packet)
+        if entry is None:
+            return []
+        return entry[1:]
                   
-    # proccess packet; deep copy packet to rxBuffer
+    # proccess packet; relay copy (shared header) to txBuffer
     def relayPacket(self,packet):
-        copy = myPacket(packet.sn,packet.src,packet.dest,self,packet.plen,packet.type)
-        copy.ttl = packet.ttl - 1
-        copy.passed.append(self.id)
+        copy = packet.relay(self)
         self.txBuffer.append(copy)
+        self.notifyTx()
         self.relay += 1
 
     # generate packet
@@ -202,12 +567,23 @@ class myNode():
         packet = myPacket(self.pkts,self,dest,self,plen,type)
         packet.passed.append(self.id)
         self.txBuffer.append(packet)
+        self.notifyTx()
         if type == 0:
             self.pkts += 1
 
+    # wake up the transceiver waiting for a packet to send
+    def notifyTx(self):
+        if self.txEvent is not None:
+            event = self.txEvent
+            self.txEvent = None
+            event.succeed()
+
     # change mode flag and update time of the last status
-    def modeTo(self,mode):
-        pastTime = env.now - self.modeStart
+    # now - time of the change, defaults to the current simulation time
+    def modeTo(self,mode,now=None):
+        if now is None:
+            now = self.sim.env.now
+        pastTime = now - self.modeStart
         if self.mode == 0:
             self.sleepTime += pastTime
         elif self.mode == 1:
@@ -215,80 +591,253 @@ class myNode():
             self.energy += pastTime * 10.5 * V / 1e6
         elif self.mode == 2:
             self.txTime += pastTime
-            self.energy += pastTime * TX[int(PTX)+2] * V / 1e6
+            self.energy += pastTime * TX[int(self.sim.PTX)+2] * V / 1e6
             for entry in self.rxBuffer:
                 entry[2] = 1 # packets not fully received are missed
         else:
             raise ValueError('Mode not defined for Node ' + str(self.id))
         self.mode = mode
-        self.modeStart = env.now
+        self.modeStart = now
+
+    # protocol bundle of EXP; resolved on first use and kept, see protocol.lookup
+    def getProtocol(self):
+        if self.proto is None:
+            self.proto = pr.lookup(self.sim.EXP)
+        return self.proto
 
-    # [next node, ... , destination node]
+    # [next node, ... , destination node]; do not modify
     def pathTo(self,dest):
-        route = []
-        if EXP in [1, 2, 3]:
-            if dest not in self.rt.destSet:
-                return route
-            atNode = self
-            while atNode.id != dest:
-                if len(route) > TTL:
-                    print('Loop Warning: hop count of route exceeds TTL')
-                    break
-                for node in nodes:
-                    if node.id == atNode.rt.nextDict[dest]:
-                        route.append(node)
-                        atNode = node
-        else:
-            raise ValueError('EXP number ' + EXP + ' is not defined') 
-        return route
+        return self.getProtocol().path(self,dest)
+
+    # node is on the route to dest, i.e. node in pathTo(dest)
+    # cached until a next hop on it changes, see routing.myForest
+    def onPath(self,node,dest):
+        return node.id in self.sim.forest.route(self,dest)[1]
     
+    # nodes used as next hop
     def getNbr(self):
-        nbr = set()
-        for other in nodes:
-            if EXP in [1, 2, 3]:
-                if other.id in self.rt.nextDict.values():
-                    nbr.add(other)
-            else:
-                raise ValueError('EXP number ' + EXP + ' is not defined')
-        return nbr
+        return self.getProtocol().nbr(self)
 
     # this function creates a routing table (associated with a node)
     class myRT():
+        HISTORY = 25 # max. no. of rssi values kept per node
+        ALPHA = 0.1 # weight of the newest rssi value in the ewma
+
         def __init__(self,node):
-            # history rssi grouped by node id
-            # dictionary of FIFO lists; list structure [rssi0, rssi1, ... , rssin]
-            self.rssiRec = {}
+            self.node = node
+
+            # history rssi grouped by node id; last HISTORY values, see routing.myRssiHistory
+            self.rssiRec = ro.myRssiHistory(self.HISTORY,self.ALPHA)
 
             # dictionary of lists of timers
             # a timer has the form (action code,execute time)
             self.timerDict = {}
 
             # dsdv table
-            self.destSet ={node.id}
-            self.nextDict = {node.id:node.id}
-            self.metricDict = {node.id:0} # hops
-            self.seqDict = {node.id:0}
+            self.store = None # network-wide store (ARRAYRT)
+            if node.sim.ARRAYRT:
+                # views onto the row of the node in the network-wide store
+                store = node.sim.getStore()
+                store.reset(node.id)
+                self.store = store
+                self.destSet = ro.myRowSet(store,node.id)
+                self.nextDict = ro.myRowDict(store,node.id,'next')
+                self.metricDict = ro.myRowDict(store,node.id,'metric') # hops
+                self.seqDict = ro.myRowDict(store,node.id,'seq')
+            else:
+                self.destSet ={node.id}
+                self.nextDict = {node.id:node.id}
+                self.metricDict = {node.id:0} # hops
+                self.seqDict = {node.id:0}
+
+            # reverse index of nextDict; next hop id -> no. of dests routed through it
+            self.nextCount = {node.id:1}
         
+        # set the dsdv entry of dest; all table updates go through here
+        def setRoute(self,dest,next,metric,seq):
+            old = self.nextDict.get(dest)
+            if old != next:
+                self.node.sim.forest.change(dest,self.node.id,old,next)
+                if old is not None:
+                    self.nextCount[old] -= 1
+                    if self.nextCount[old] == 0:
+                        del self.nextCount[old]
+                self.nextCount[next] = self.nextCount.get(next,0) + 1
+            self.destSet.add(dest)
+            self.nextDict[dest] = next
+            self.metricDict[dest] = metric
+            self.seqDict[dest] = seq
+
+        # set the entries of several dests (array) to one next hop; array tables only
+        def setRoutes(self,dests,next,metrics,seqs):
+            store = self.store
+            id = self.node.id
+            known = store.has[id,dests]
+            olds = store.next[id,dests]
+            changed = ~known | (olds != next)
+            for dest,old,k in zip(dests[changed].tolist(),olds[changed].tolist(),known[changed].tolist()):
+                old = old if k else None
+                self.node.sim.forest.change(dest,id,old,next)
+                if old is not None:
+                    self.nextCount[old] -= 1
+                    if self.nextCount[old] == 0:
+                        del self.nextCount[old]
+                self.nextCount[next] = self.nextCount.get(next,0) + 1
+            store.has[id,dests] = True
+            store.next[id,dests] = next
+            store.metric[id,dests] = metrics
+            store.seq[id,dests] = seqs
+
         # record new rssi value
         def newRssi(self,txid,rssi):
-            if txid in self.rssiRec.keys():
-                self.rssiRec[txid].append(rssi)
-                # maximum size
-                if len(self.rssiRec[txid]) > 25:
-                    self.rssiRec[txid].pop(0)
-            else:
-                self.rssiRec[txid] = [rssi]
+            self.rssiRec.add(txid,rssi)
 
 #
-# this function creates a packet
-# it also sets all parameters
+# network-wide node state (ARRAYSTATE)
+# struct of arrays indexed by node id; the arrays are the rows of one block, so the
+# counters of all nodes are copied at once and reduced without a loop over nodes
+# counters are stored as floats (exact up to 2**53) and read back as int
 #
-class myPacket():
-    def __init__(self,sn,src,dest,txNode,plen,type):
+class myNodeState():
+    INTS = ('mode','coll','miss','atte','relay','pkts','arr')
+    FLOATS = ('modeStart','sleepTime','rxTime','txTime','energy')
+    FIELDS = INTS + FLOATS
+
+    def __init__(self,size=16):
+        self.size = 0 # no. of columns in use
+        self.nodes = {} # id -> node viewing its column, see myStateNode
+        self.alloc(size)
+
+    def alloc(self,capacity):
+        self.capacity = capacity
+        self.block = np.zeros((len(self.FIELDS),capacity))
+        self.views()
+
+    # one array per field, viewing its row of block, and one column per node
+    def views(self):
+        for k,name in enumerate(self.FIELDS):
+            setattr(self,name,self.block[k])
+        for id,node in self.nodes.items():
+            node.col = self.block[:,id]
+
+    # views are rebuilt from the block, so copies keep sharing it
+    def __getstate__(self):
+        return {'size': self.size, 'capacity': self.capacity, 'block': self.block, 'nodes': self.nodes}
+
+    # nodes may still be empty here (copy of a cycle); col is kept by their own state
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.views()
+
+    # make room for node id; capacity is doubled
+    def grow(self,id):
+        if id >= self.capacity:
+            capacity = self.capacity
+            while capacity <= id:
+                capacity *= 2
+            old = self.block
+            self.alloc(capacity)
+            self.block[:,:old.shape[1]] = old
+            self.views()
+        self.size = max(self.size,id+1)
+
+    # zero state of node id
+    def reset(self,id):
+        if id < 0:
+            raise ValueError('Node ' + str(id) + ' cannot be stored in a node state')
+        self.grow(id)
+        self.block[:,id] = 0
+
+    # sums of the fields names over node ids
+    # cumsum adds in the order of ids like a loop over the nodes, so float sums are the same
+    def totals(self,ids,names):
+        total = {}
+        for name in names:
+            values = getattr(self,name)[ids]
+            value = np.cumsum(values)[-1].item() if len(values) else 0
+            total[name] = int(value) if name in self.INTS else value
+        return total
+
+    # per-node rates of node ids; nan where undefined
+    # pdr/ar per generated packet, cr/mr per packet not lost to path loss
+    def rates(self,ids):
+        pkts = self.pkts[ids]
+        kept = pkts - self.atte[ids]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            pdr = np.where(pkts != 0,self.arr[ids]/pkts,np.nan)
+            ar = np.where(pkts != 0,self.atte[ids]/pkts,np.nan)
+            cr = np.where(kept != 0,self.coll[ids]/kept,np.nan)
+            mr = np.where(kept != 0,self.miss[ids]/kept,np.nan)
+        return pdr,ar,cr,mr
+
+# rows of the fields used by myStateNode.modeTo
+MODE,MODESTART,SLEEPTIME,RXTIME,TXTIME,ENERGY = [myNodeState.FIELDS.index(name) for name in ('mode','modeStart','sleepTime','rxTime','txTime','energy')]
+
+# attribute of a node viewing field k of its column of the node state
+def stateProperty(k,type):
+    def get(self):
+        return type(self.col.item(k))
+    def set(self,value):
+        self.col[k] = value
+    return property(get,set)
+
+#
+# node whose counters, energy and mode live in the node state of its simulation
+# the node keeps a view of its column (col), replaced when the state grows; every
+# access still costs more than a plain attribute, see ARRAYSTATE
+#
+class myStateNode(myNode):
+    STATEFUL = True
+
+    def __init__(self,id,x,y,sim=None):
+        state = (sim if sim is not None else moduleSim).getState()
+        state.reset(id)
+        state.nodes[id] = self
+        self.col = state.block[:,id]
+        super().__init__(id,x,y,sim)
+
+    # myNode.modeTo on the column directly; it runs on every mode change, so it
+    # does not go through the per-field properties
+    def modeTo(self,mode,now=None):
+        if now is None:
+            now = self.sim.env.now
+        col = self.col
+        pastTime = now - col.item(MODESTART)
+        old = col.item(MODE)
+        if old == 0:
+            col[SLEEPTIME] = col.item(SLEEPTIME) + pastTime
+        elif old == 1:
+            col[RXTIME] = col.item(RXTIME) + pastTime
+            col[ENERGY] = col.item(ENERGY) + pastTime * 10.5 * V / 1e6
+        elif old == 2:
+            col[TXTIME] = col.item(TXTIME) + pastTime
+            col[ENERGY] = col.item(ENERGY) + pastTime * TX[int(self.sim.PTX)+2] * V / 1e6
+            for entry in self.rxBuffer:
+                entry[2] = 1 # packets not fully received are missed
+        else:
+            raise ValueError('Mode not defined for Node ' + str(self.id))
+        col[MODE] = mode
+        col[MODESTART] = now
+
+    # a copied view would not share the copied block; set by the copied node state
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['col']
+        return state
+
+for k,name in enumerate(myNodeState.FIELDS):
+    setattr(myStateNode,name,stateProperty(k,int if name in myNodeState.INTS else float))
+
+#
+# immutable part of a packet, shared by the packet and all its relay copies
+#
+class myHeader():
+    __slots__ = ('sn','src','dest','plen','type','txpow','sf','cr','bw','freq')
+
+    def __init__(self,sn,src,dest,plen,type,sim):
         self.sn = sn # serial number of packet at src node
         self.src = src # src node
         self.dest = dest # dest id
-        self.txNode = txNode
         self.plen = plen
         
         # packet type identifier:
@@ -297,105 +846,254 @@ class myPacket():
         self.type = type
 
         # default RF settings
-        self.txpow = PTX
-        self.sf = SF
-        self.cr = CR
-        self.bw = BW
-        self.freq = FREQ
+        self.txpow = sim.PTX
+        self.sf = sim.SF
+        self.cr = sim.CR
+        self.bw = sim.BW
+        self.freq = sim.FREQ
 
-        self.ttl = TTL # time to live (hops)
+#
+# this function creates a packet
+# it also sets all parameters
+# header fields (sn, src, dest, plen, type, RF settings) are read-only and shared
+# with relay copies, see relay; only the per-hop state is held by the packet
+#
+class myPacket():
+    __slots__ = ('header','txNode','ttl','appearTime','endTime','rssiAt','passed')
 
+    def __init__(self,sn,src,dest,txNode,plen,type):
+        sim = txNode.sim
+        self.header = myHeader(sn,src,dest,plen,type,sim)
+        self.txNode = txNode
+        self.ttl = sim.TTL # time to live (hops)
         self.appearTime = None
-        self.rssiAt = {} # rssi at rx nodes
+        self.endTime = None # appearTime + airtime, set on transmission
+        self.rssiAt = None # id -> rssi; nodes above sensitivity while on air, decoders after delivery
         self.passed = [] # passed nodes
+
+    # copy of the packet to be sent by txNode on the next hop
+    def relay(self,txNode):
+        copy = myPacket.__new__(myPacket)
+        copy.header = self.header
+        copy.txNode = txNode
+        copy.ttl = self.ttl - 1
+        copy.appearTime = None
+        copy.endTime = None
+        copy.rssiAt = None
+        copy.passed = [txNode.id]
+        return copy
     
     # channel estimation - compute rssi at rx nodes
     # call this function when packet is transmitted
-    def chanEst(self,nodes):
-        for rxNode in (node for node in nodes if node != self.txNode):
-            gamma = 2.75 # path loss exponent
-            d0 = 1 # ref. distance in m
-            PLd0 = 74.85 # mean path loss at d0
-            GL = 0 # combined gain
-            # log-shadow
-            dist = math.sqrt((self.txNode.x-rxNode.x)**2+(self.txNode.y - rxNode.y)**2)
-            PL = PLd0 + 10*gamma*math.log10(dist/d0) + random.gauss(0,SIGMA)
-            self.rssiAt[rxNode] = self.txpow + GL - PL
+    # the channel realization of all nodes lives in a pooled buffer of the channel for
+    # the duration of this call; the packet keeps the rssi of nodes above sensitivity
+    # return ids of these nodes, ascending
+    def chanEst(self,nodes,sensitivity):
+        sim = self.txNode.sim
+        chan = sim.getChannel(nodes)
+        # log-shadow, batched over all rx nodes
+        if sim.KSIGMA is None:
+            buffer = chan.take()
+            rssi = chan.rssi(self.txNode.id,self.header.txpow,sim.SIGMA,out=buffer)
+            heard = np.flatnonzero(rssi - sensitivity > 0) # -inf at the tx node
+            self.rssiAt = dict(zip(heard.tolist(),rssi[heard].tolist()))
+            chan.give(buffer)
+            return heard.tolist()
+        # only nodes within the k-sigma cutoff radius
+        r = ch.radius(self.header.txpow,sensitivity,sim.SIGMA,sim.KSIGMA)
+        rx = chan.candidates(self.txNode.id,r,sim.KSIGMA)
+        rssi = chan.rssiTo(self.txNode.id,self.header.txpow,sim.SIGMA,rx)
+        good = rssi - sensitivity > 0
+        heard = rx[good].tolist()
+        self.rssiAt = dict(zip(heard,rssi[good].tolist()))
+        return heard
 
     def airtime(self):
-        sf = self.sf
-        cr = self.cr
-        bw = self.bw
-        plen = self.plen
-        # computes the airtime of a packet according to LoraDesignGuide_STD.pdf
-        H = 1        # implicit header disabled (H=0) or not (H=1)
-        DE = 0       # low data rate optimization enabled (=1) or not (=0)
-        Npream = 8   # number of preamble symbol (12.25 from Utz paper)
-        Tsym = (2.0**sf)/bw # symbol time
-        Tpream = (Npream + 4.25)*Tsym
-        payloadSymbNB = 8 + max(math.ceil((8.0*plen-4.0*sf+28+16-20*H)/(4.0*(sf-2*DE)))*(cr+4),0)
-        Tpayload = payloadSymbNB * Tsym
-        return Tpream + Tpayload
+        header = self.header
+        return airtime(header.sf,header.cr,header.bw,header.plen)
+
+# read-only access to the header fields; the simulator itself reads packet.header,
+# each of these costs a descriptor call
+for name in myHeader.__slots__:
+    setattr(myPacket,name,property(attrgetter('header.' + name)))
+
+#
+# timing tables
+# memoized per parameter set; only a handful of combinations occur in a run
+#
+
+# computes the airtime of a packet according to LoraDesignGuide_STD.pdf
+# H - implicit header disabled (H=0) or not (H=1)
+# DE - low data rate optimization enabled (=1) or not (=0)
+@lru_cache(maxsize=1024)
+def airtime(sf,cr,bw,plen,H=1,DE=0):
+    Npream = 8   # number of preamble symbol (12.25 from Utz paper)
+    Tsym = (2.0**sf)/bw # symbol time
+    Tpream = (Npream + 4.25)*Tsym
+    payloadSymbNB = 8 + max(math.ceil((8.0*plen-4.0*sf+28+16-20*H)/(4.0*(sf-2*DE)))*(cr+4),0)
+    Tpayload = payloadSymbNB * Tsym
+    return Tpream + Tpayload
+
+# minimum preamble time that can be lost in a collision
+@lru_cache(maxsize=64)
+def preambTime(sf,bw):
+    # assuming 8 preamble symbols
+    Npream = 8
+    # we can lose at most (Npream - 5) * Tsym of our preamble; symbol time Tsym = (2.0**sf)/bw
+    return 2**sf/(1.0*bw) * (Npream - 5)
 
 #
 # A finite state machine running on every node 
 #
-def transceiver(env,txNode):
-    global nodes
+# before every wait the node records how to resume (node.wake), so that a
+# restored snapshot can recreate the process:
+#   ('start',seq) - not started yet
+#   ('wait',time,seq,act) - timeout until time, then next loop
+#   ('air',time,seq,act,packet,heard) - packet on air until time, then delivery and a timeout of act[2]
+#   ('idle',seq,act) - blocked in idle, see node.idleSlot
+# act is the last action of the proactive process; seq orders wake-ups at the same time
+# like the event ids of the kernel
+#
+def transceiver(env,txNode,wake=None):
+    sim = txNode.sim
+    proactive = txNode.getProtocol().proactive
+    # restored process
+    if wake is not None:
+        act = yield from resume(env,txNode,wake)
     while True:
         # to receive
         if txNode.mode == 1:
-            if EXP in [1, 2, 3]:
-                act = pr.proactive1(txNode,env.now)
-            else:
-                raise ValueError('EXP number ' + EXP + ' is not defined')
+            act = proactive(txNode,env.now)
             txNode.modeTo(act[0])
-            yield env.timeout(act[1])
+            if sim.EVENTMAC and act[0] == 1 and env.now > 0:
+                yield from idle(env,txNode,act)
+            else:
+                txNode.wake = ('wait',env.now + act[1],next(wakeSeq),act)
+                yield env.timeout(act[1])
         # to transmit
         elif txNode.mode == 2:
-            # transmit packet
-            packet = txNode.txBuffer.pop(0)
-            packet.appearTime = env.now
-            packet.chanEst(nodes)
-            sensitivity = sensi[packet.sf - 7, [125,250,500].index(packet.bw) + 1]
-            ids = [i for i in range(len(nodes)) if i != txNode.id] 
-            # receive packet
-            for i in ids:
-                if packet.rssiAt[nodes[i]] - sensitivity > 0: # rssi good at receiver, add packet to rxBuffer
-                    col = checkcollision(packet,nodes[i]) # side effect: also change collision flags of other packets                    
-                    mis = (nodes[i].mode != 1) # receiver not in rx mode
-                    nodes[i].rxBuffer.append([packet,col,mis]) # log packet along with appear time and flags
+            packet,heard = transmit(txNode)
+            txNode.wake = ('air',packet.endTime,next(wakeSeq),act,packet,heard)
             yield env.timeout(packet.airtime()) # airtime
-            # complete packet has been processed by rx node; can remove it
-            for i in ids:
-                result = nodes[i].checkDelivery(packet) # side effect: packet removed from rxBuffer
-                # rssi good and no col or mis
-                if result and not any(result):
-                    if EXP == 1:
-                        pr.reactive1(packet,txNode,nodes[i],packet.rssiAt[nodes[i]])
-                    elif EXP == 2:
-                        pr.reactive2(packet,txNode,nodes[i],packet.rssiAt[nodes[i]])
-                    elif EXP == 3:
-                        pr.reactive3(packet,txNode,nodes[i],packet.rssiAt[nodes[i]])
-                    else:
-                        raise ValueError('EXP number ' + EXP + ' is not defined')
-                # catch losing condition when node is critical
-                else:
-                    if EXP in [1, 2, 3]:
-                        cl.catch1(packet,txNode,nodes[i],result)
-                    else:
-                        raise ValueError('EXP number ' + EXP + ' is not defined')
+            deliver(txNode,packet,heard)
             txNode.modeTo(1)
+            txNode.wake = ('wait',env.now + act[2],next(wakeSeq),act)
             yield env.timeout(act[2])
         # to sleep
         else:
             pass
 
+# order of recorded wake-ups
+wakeSeq = count()
+
+# wait for the recorded wake-up of a restored transceiver; return the last action
+def resume(env,txNode,wake):
+    if wake[0] == 'wait':
+        yield env.timeout(wake[1] - env.now)
+    elif wake[0] == 'air':
+        _,t,_,act,packet,heard = wake
+        yield env.timeout(t - env.now)
+        deliver(txNode,packet,heard)
+        txNode.modeTo(1)
+        txNode.wake = ('wait',env.now + act[2],next(wakeSeq),act)
+        yield env.timeout(act[2])
+    elif wake[0] == 'idle':
+        yield from idleWait(env,txNode,wake[2])
+    return wake[-1]
+
+# start transmission of the head of txBuffer; return (packet, ids of nodes that heard it)
+def transmit(txNode):
+    nodes = txNode.sim.nodes
+    packet = txNode.txBuffer.pop(0)
+    packet.appearTime = txNode.sim.env.now
+    packet.endTime = packet.appearTime + packet.airtime()
+    header = packet.header
+    sensitivity = sensi[header.sf - 7, [125,250,500].index(header.bw) + 1]
+    heard = packet.chanEst(nodes,sensitivity) # rssi good at receiver
+    # receive packet; add packet to rxBuffer
+    for i in heard:
+        col = checkcollision(packet,nodes[i]) # side effect: also change collision flags of other packets
+        mis = (nodes[i].mode != 1) # receiver not in rx mode
+        nodes[i].rxBuffer.append([packet,col,mis]) # log packet along with appear time and flags
+    return packet,heard
+
+# end of transmission; complete packet has been processed by rx nodes
+# afterwards the packet only keeps the rssi at the nodes that decoded it
+def deliver(txNode,packet,heard):
+    nodes = txNode.sim.nodes
+    proto = txNode.proto
+    rssi = packet.rssiAt
+    decoded = {}
+    # packet never buffered (lost to path loss); only matters for nodes watched by the loss catcher
+    for i in proto.watch(packet,txNode):
+        if i != txNode.id and i not in heard:
+            proto.catch(packet,txNode,nodes[i],[])
+    # can remove it
+    for i in heard:
+        result = nodes[i].checkDelivery(packet) # side effect: packet removed from rxBuffer
+        # rssi good and no col or mis
+        if result and not any(result):
+            decoded[i] = rssi[i]
+            proto.reactive(packet,txNode,nodes[i],rssi[i])
+        # catch losing condition when node is critical
+        else:
+            proto.catch(packet,txNode,nodes[i],result)
+    packet.rssiAt = decoded
+
+#
+# event-driven wait in rx mode before the next p-csma slot
+# a node with nothing to send blocks until its txBuffer becomes non-empty, a node
+# holding a packet on a busy channel blocks until its rxBuffer is empty; it then
+# resumes at the first slot of the grid it would have polled on (slot length act[1]),
+# so the slots checked by proactive1 are the same as with polling
+# rx time of the skipped slots is accounted as if the node had polled
+# nodes waking at the same instant can run in another order than their polls would
+# have (the kernel orders them by when their timeouts were scheduled, which differs),
+# and then take each other's random numbers; results are statistically equivalent
+# to polling, not identical, see bench_csma
+#
+def idle(env,node,act):
+    node.idleSlot = [env.now + act[1],act[1]] # next slot
+    yield from idleWait(env,node,act)
+
+def idleWait(env,node,act):
+    node.wake = ('idle',next(wakeSeq),act)
+    while True:
+        if not node.txBuffer:
+            node.txEvent = env.event()
+            yield node.txEvent
+        elif node.rxBuffer:
+            node.rxBuffer.clearEvent = env.event()
+            yield node.rxBuffer.clearEvent
+        else:
+            break
+        catchUp(node,env.now)
+    t = node.idleSlot[0]
+    node.idleSlot = None
+    node.wake = ('wait',t,next(wakeSeq),act)
+    yield env.timeout(t - env.now)
+
+# account the slots of an idle node before time t; same float additions as consecutive timeouts
+def catchUp(node,t):
+    slot = node.idleSlot
+    while slot[0] < t:
+        node.modeTo(1,slot[0])
+        slot[0] += slot[1]
+
+# account the rx time of nodes still blocked in idle; call after env.run with EVENTMAC
+def settle():
+    moduleSim.settle()
+
 #
 # spontaneous data packet generator
 # use this function when packet generation is NOT controlled by MAC protocol
+# the next generation is recorded in node.genWake like transceiver wake-ups
 #
-def generator(env,node):
+def generator(env,node,wake=None):
+    # restored process
+    if wake is not None and wake[0] == 'wait':
+        yield env.timeout(wake[1] - env.now)
     while True:
         dt = pr.expoGen(node)
-        yield env.timeout(dt)
\ No newline at end of file
+        node.genWake = ('wait',env.now + dt,next(wakeSeq))
+        yield env.timeout(dt)
@@ -1,9 +1,10 @@
-import random
 import reporting as rp
-import network as nw
+import routing as ro
+import catchloss as cl
 
 #
 # CONSTANTS
+# defaults of the simulation parameters, see network.Simulation
 #
 
 # real-time show
@@ -39,22 +40,23 @@ plenC = 20 # beacon
 
 # p-csma + dsdv
 def proactive1(txNode,t0):
+    sim = txNode.sim
     nxMode = 1
     dt1 = 0
     dt2 = 0
     # initialize randomness to first time frame
     if t0 == 0:
-        dt1 = random.randint(0,5000)
+        dt1 = sim.rng.randint(0,5000)
         return nxMode,dt1,dt2
     # p-csma
     if txNode.txBuffer:
-        packet = txNode.txBuffer[0]
+        header = txNode.txBuffer[0].header
         # hold packet when channel is busy or no route for non-beacon packet
-        if txNode.rxBuffer or (packet.type != 1 and (packet.dest not in txNode.rt.destSet)):
+        if txNode.rxBuffer or (header.type != 1 and (header.dest not in txNode.rt.destSet)):
             dt1 = 500
         else:
             # transmit with p0 possibility
-            if (random.random() <= p0):
+            if (sim.rng.random() <= sim.p0):
                 nxMode = 2 # mode to tx
             else:
                 # >p0, wait till next slot
@@ -73,47 +75,60 @@ def proactive1(txNode,t0):
 #   dt2 - time before the next process after the next mode is done
 #
 
+# batched beacon merge for array tables (ARRAYRT); same decisions as the loops of
+# reactive1/2/3 (variant), see routing.merge
+# return True if the table of rxNode was updated
+def merge(txNode,rxNode,variant,avg=None,num=None):
+    dests,metrics,seqs = ro.merge(txNode,rxNode,variant,avg,num)
+    rxNode.rt.setRoutes(dests,txNode.id,metrics,seqs)
+    # real-time topology
+    if rxNode.sim.rts == True and 0 in dests:
+        rp.plot_tree(rxNode.sim.nodes)
+        rp.save()
+        rp.close()
+    return len(dests) > 0
+
 # p-csma + dsdv
 def reactive1(packet,txNode,rxNode,rssi):
-    if packet.type == 0:
+    header = packet.header
+    if header.type == 0:
         # not supposed to receive, wasted
-        if txNode.rt.nextDict[packet.dest] != rxNode.id:
+        if txNode.rt.nextDict[header.dest] != rxNode.id:
             pass
         # arrive at next/dest
         else:
-            if packet.dest == rxNode.id:
-                packet.src.arr += 1
-                if packet.src.arr > packet.src.pkts:
-                    raise ValueError('Node ' + str(packet.src.id) + ' has more arrived than generated.')
+            if header.dest == rxNode.id:
+                header.src.arr += 1
+                if header.src.arr > header.src.pkts:
+                    raise ValueError('Node ' + str(header.src.id) + ' has more arrived than generated.')
             elif packet.ttl > 0:
                 rxNode.relayPacket(packet)
             # pkt runs out of ttl before reaching dest
             else:
                 pass
     # routing beacon
-    elif packet.type == 1:
+    elif header.type == 1:
         # update routing table
-        update = False # flag needed because there can be multiple entries to update
-        next = txNode.id
-        for dest in txNode.rt.destSet:
-            metric = txNode.rt.metricDict[dest] + 1
-            seq = txNode.rt.seqDict[dest]
-            # existing dest
-            if dest in rxNode.rt.destSet:
-                if seq < rxNode.rt.seqDict[dest] or metric >= rxNode.rt.metricDict[dest]:
-                    continue
-            # new dest
-            else:       
-                rxNode.rt.destSet.add(dest)
-            rxNode.rt.nextDict[dest] = next
-            rxNode.rt.metricDict[dest] = metric
-            rxNode.rt.seqDict[dest] = seq
-            update = True
-            # real-time topology
-            if rts == True and dest == 0:
-                rp.plot_tree(nw.nodes)
-                rp.save()
-                rp.close()
+        # array tables: all destinations at once
+        if rxNode.rt.store is not None:
+            update = merge(txNode,rxNode,1)
+        else:
+            update = False # flag needed because there can be multiple entries to update
+            next = txNode.id
+            for dest in txNode.rt.destSet:
+                metric = txNode.rt.metricDict[dest] + 1
+                seq = txNode.rt.seqDict[dest]
+                # existing dest
+                if dest in rxNode.rt.destSet:
+                    if seq < rxNode.rt.seqDict[dest] or metric >= rxNode.rt.metricDict[dest]:
+                        continue
+                rxNode.rt.setRoute(dest,next,metric,seq)
+                update = True
+                # real-time topology
+                if rxNode.sim.rts == True and dest == 0:
+                    rp.plot_tree(rxNode.sim.nodes)
+                    rp.save()
+                    rp.close()
         # broadcast table(beacon)
         if update and packet.ttl > 0:
             rxNode.rt.seqDict[rxNode.id] += 2
@@ -123,65 +138,66 @@ def reactive1(packet,txNode,rxNode,rssi):
 
 # p-csma + dsdv (with memory)
 def reactive2(packet,txNode,rxNode,rssi):
-    if packet.type == 0:
+    header = packet.header
+    if header.type == 0:
         # not supposed to receive, wasted
-        if txNode.rt.nextDict[packet.dest] != rxNode.id:
+        if txNode.rt.nextDict[header.dest] != rxNode.id:
             pass
         # arrive at next/dest
         else:
-            if packet.dest == rxNode.id:
-                packet.src.arr += 1
-                if packet.src.arr > packet.src.pkts:
-                    raise ValueError('Node ' + str(packet.src.id) + ' has more arrived than generated.')
+            if header.dest == rxNode.id:
+                header.src.arr += 1
+                if header.src.arr > header.src.pkts:
+                    raise ValueError('Node ' + str(header.src.id) + ' has more arrived than generated.')
             elif packet.ttl > 0:
                 rxNode.relayPacket(packet)
             # pkt runs out of ttl before reaching dest
             else:
                 pass
     # routing beacon
-    elif packet.type == 1:
+    elif header.type == 1:
+        sim = rxNode.sim
         # update routing table
         rxNode.rt.newRssi(txNode.id,rssi)
-        update = False # flag needed because there can be multiple entries to update
         next = txNode.id
-        sample_num = len(rxNode.rt.rssiRec[next])
-        avg_rssi =  sum(rxNode.rt.rssiRec[next])/sample_num
-        # dsdv with hysteresis
-        dests = (dest for dest in txNode.rt.destSet if dest != rxNode.id)
-        for dest in dests:
-            # prevent loop
-            if txNode.rt.nextDict[dest] == rxNode.id:
-                continue
-            metric = txNode.rt.metricDict[dest] + 1
-            seq = txNode.rt.seqDict[dest]
-            # existing dest
-            if dest in rxNode.rt.destSet:
-                if seq < rxNode.rt.seqDict[dest] or metric > HL:
+        sample_num = rxNode.rt.rssiRec.count(next)
+        avg_rssi = rxNode.rt.rssiRec.mean(next)
+        # array tables: all destinations at once
+        if rxNode.rt.store is not None:
+            update = merge(txNode,rxNode,2,avg_rssi,sample_num)
+        else:
+            update = False # flag needed because there can be multiple entries to update
+            # dsdv with hysteresis
+            dests = (dest for dest in txNode.rt.destSet if dest != rxNode.id)
+            for dest in dests:
+                # prevent loop
+                if txNode.rt.nextDict[dest] == rxNode.id:
                     continue
-                else:
-                    old = rxNode.rt.nextDict[dest]
-                    old_avg = sum(rxNode.rt.rssiRec[old])/len(rxNode.rt.rssiRec[old])
-                    # if metric is better and rssi is not too worse, allow update
-                    if metric < rxNode.rt.metricDict[dest] and (avg_rssi > old_avg - RM1):
-                        pass
-                    # if metric is not too worse and rssi is significantly better, reroute to ensure link quality
-                    elif metric <= rxNode.rt.metricDict[dest] + 1 and (avg_rssi > old_avg + RM2):
-                        pass
-                    # reject update if rssi or metric is bad
-                    else:
+                metric = txNode.rt.metricDict[dest] + 1
+                seq = txNode.rt.seqDict[dest]
+                # existing dest
+                if dest in rxNode.rt.destSet:
+                    if seq < rxNode.rt.seqDict[dest] or metric > sim.HL:
                         continue
-            # new dest
-            else:
-                rxNode.rt.destSet.add(dest)
-            rxNode.rt.nextDict[dest] = next
-            rxNode.rt.metricDict[dest] = metric
-            rxNode.rt.seqDict[dest] = seq
-            update = True
-            # real-time topology
-            if rts == True and dest == 0:
-                rp.plot_tree(nw.nodes)
-                rp.save()
-                rp.close()
+                    else:
+                        old = rxNode.rt.nextDict[dest]
+                        old_avg = rxNode.rt.rssiRec.mean(old)
+                        # if metric is better and rssi is not too worse, allow update
+                        if metric < rxNode.rt.metricDict[dest] and (avg_rssi > old_avg - sim.RM1):
+                            pass
+                        # if metric is not too worse and rssi is significantly better, reroute to ensure link quality
+                        elif metric <= rxNode.rt.metricDict[dest] + 1 and (avg_rssi > old_avg + sim.RM2):
+                            pass
+                        # reject update if rssi or metric is bad
+                        else:
+                            continue
+                rxNode.rt.setRoute(dest,next,metric,seq)
+                update = True
+                # real-time topology
+                if rxNode.sim.rts == True and dest == 0:
+                    rp.plot_tree(rxNode.sim.nodes)
+                    rp.save()
+                    rp.close()
         # broadcast table(beacon)
         if update and packet.ttl > 0:
             rxNode.rt.seqDict[rxNode.id] += 2
@@ -192,72 +208,73 @@ def reactive2(packet,txNode,rxNode,rssi):
 # p-csma + dsdv (with memory)
 # unlimited divergence at the beginning
 def reactive3(packet,txNode,rxNode,rssi):
-    if packet.type == 0:
+    header = packet.header
+    if header.type == 0:
         # not supposed to receive, wasted
-        if txNode.rt.nextDict[packet.dest] != rxNode.id:
+        if txNode.rt.nextDict[header.dest] != rxNode.id:
             pass
         # arrive at next/dest
         else:
-            if packet.dest == rxNode.id:
-                packet.src.arr += 1
-                if packet.src.arr > packet.src.pkts:
-                    raise ValueError('Node ' + str(packet.src.id) + ' has more arrived than generated.')
+            if header.dest == rxNode.id:
+                header.src.arr += 1
+                if header.src.arr > header.src.pkts:
+                    raise ValueError('Node ' + str(header.src.id) + ' has more arrived than generated.')
             elif packet.ttl > 0:
                 rxNode.relayPacket(packet)
             # pkt runs out of ttl before reaching dest
             else:
                 pass
     # routing beacon
-    elif packet.type == 1:
+    elif header.type == 1:
+        sim = rxNode.sim
         # update routing table
         rxNode.rt.newRssi(txNode.id,rssi)
-        update = False # flag needed because there can be multiple entries to update
         next = txNode.id
-        sample_num = len(rxNode.rt.rssiRec[next])
-        avg_rssi =  sum(rxNode.rt.rssiRec[next])/sample_num
-        # dsdv with hysteresis
-        dests = (dest for dest in txNode.rt.destSet if dest != rxNode.id)
-        for dest in dests:
-            # prevent loop
-            if rxNode in txNode.pathTo(dest):
-                continue
-            metric = txNode.rt.metricDict[dest] + 1
-            seq = txNode.rt.seqDict[dest]
-            # existing dest
-            if dest in rxNode.rt.destSet:
-                if seq < rxNode.rt.seqDict[dest] or metric > HL:
-                    continue
-                else:
-                    old = rxNode.rt.nextDict[dest]
-                    old_avg = sum(rxNode.rt.rssiRec[old])/len(rxNode.rt.rssiRec[old])
-                    # conditionally update established routes (converge + diverge)
-                    if sample_num >= len(rxNode.rt.rssiRec[old]) >= 5:
-                        # if metric is better and rssi is not too worse, allow update
-                        if metric < rxNode.rt.metricDict[dest] and (avg_rssi > old_avg - RM1):
-                            pass
-                        # if metric is not too worse and rssi is significantly better, reroute to ensure link quality
-                        elif metric <= rxNode.rt.metricDict[dest] + 1 and (avg_rssi > old_avg + RM2):
-                            pass
-                        # reject update if rssi or metric is bad
+        sample_num = rxNode.rt.rssiRec.count(next)
+        avg_rssi = rxNode.rt.rssiRec.mean(next)
+        # array tables: all destinations at once
+        if rxNode.rt.store is not None:
+            update = merge(txNode,rxNode,3,avg_rssi,sample_num)
+        else:
+            update = False # flag needed because there can be multiple entries to update
+            # dsdv with hysteresis
+            dests = (dest for dest in txNode.rt.destSet if dest != rxNode.id)
+            for dest in dests:
+                metric = txNode.rt.metricDict[dest] + 1
+                seq = txNode.rt.seqDict[dest]
+                # existing dest
+                if dest in rxNode.rt.destSet:
+                    if seq < rxNode.rt.seqDict[dest] or metric > sim.HL:
+                        continue
+                    else:
+                        old = rxNode.rt.nextDict[dest]
+                        old_avg = rxNode.rt.rssiRec.mean(old)
+                        # conditionally update established routes (converge + diverge)
+                        if sample_num >= rxNode.rt.rssiRec.count(old) >= 5:
+                            # if metric is better and rssi is not too worse, allow update
+                            if metric < rxNode.rt.metricDict[dest] and (avg_rssi > old_avg - sim.RM1):
+                                pass
+                            # if metric is not too worse and rssi is significantly better, reroute to ensure link quality
+                            elif metric <= rxNode.rt.metricDict[dest] + 1 and (avg_rssi > old_avg + sim.RM2):
+                                pass
+                            # reject update if rssi or metric is bad
+                            else:
+                                continue
+                        # rssi oriented rerouting when sample not enough (diverge)
+                        elif sample_num >= rxNode.rt.rssiRec.count(old) and avg_rssi > old_avg:
+                                pass
                         else:
                             continue
-                    # rssi oriented rerouting when sample not enough (diverge)
-                    elif sample_num >= len(rxNode.rt.rssiRec[old]) and avg_rssi > old_avg:
-                            pass
-                    else:
-                        continue
-            # new dest
-            else:
-                rxNode.rt.destSet.add(dest)
-            rxNode.rt.nextDict[dest] = next
-            rxNode.rt.metricDict[dest] = metric
-            rxNode.rt.seqDict[dest] = seq
-            update = True
-            # real-time topology
-            if rts == True and dest == 0:
-                rp.plot_tree(nw.nodes)
-                rp.save()
-                rp.close()
+                # prevent loop; checked last as the other tests are cheaper and reject most updates
+                if txNode.onPath(rxNode,dest):
+                    continue
+                rxNode.rt.setRoute(dest,next,metric,seq)
+                update = True
+                # real-time topology
+                if rxNode.sim.rts == True and dest == 0:
+                    rp.plot_tree(rxNode.sim.nodes)
+                    rp.save()
+                    rp.close()
         # broadcast table(beacon)
         if update and packet.ttl > 0:
             rxNode.rt.seqDict[rxNode.id] += 2
@@ -276,12 +293,12 @@ def reactive3(packet,txNode,rxNode,rssi):
 def periGen(node):
     # GW
     if node.id == 0:
-        node.genPacket(0,plenC,1)
+        node.genPacket(0,node.sim.plenC,1)
         dt = 10*60*1000
     # end devices
     elif node.id > 0:
-        node.genPacket(0,plenB,0)
-        dt = avgGenTime
+        node.genPacket(0,node.sim.plenB,0)
+        dt = node.sim.avgGenTime
     else:
         raise ValueError('undefined node id')
     return dt
@@ -290,12 +307,61 @@ def periGen(node):
 def expoGen(node):
     # GW
     if node.id == 0:
-        node.genPacket(0,plenC,1)
+        node.genPacket(0,node.sim.plenC,1)
         dt = 10*60*1000
     # end devices
     elif node.id > 0:
-        node.genPacket(0,plenB,0)
-        dt = random.expovariate(1.0/avgGenTime)
+        node.genPacket(0,node.sim.plenB,0)
+        dt = node.sim.rng.expovariate(1.0/node.sim.avgGenTime)
     else:
         raise ValueError('undefined node id')
-    return dt
\ No newline at end of file
+    return dt
+
+#
+# protocol registry
+# a protocol bundles the callables of one variant; nodes resolve the bundle of EXP
+# once (myNode.getProtocol) and the transceiver calls them directly
+#   proactive(txNode,t0) -> (nxMode,dt1,dt2), see proactive1
+#   reactive(packet,txNode,rxNode,rssi) - packet decoded at rxNode
+#   catch(packet,txNode,rxNode,result) - packet lost at rxNode, see catchloss
+#   watch(packet,txNode) -> ids of rx nodes catch accounts for when they never received the packet
+#   path(node,dest) -> [next node, ... , destination node]
+#   nbr(node) -> set of neighbour nodes in the routing table
+#
+class myProtocol():
+    def __init__(self,proactive,reactive,catch,watch,path,nbr):
+        self.proactive = proactive
+        self.reactive = reactive
+        self.catch = catch
+        self.watch = watch
+        self.path = path
+        self.nbr = nbr
+
+PROTOCOLS = {} # EXP no. -> myProtocol
+
+def register(exp,protocol):
+    PROTOCOLS[exp] = protocol
+
+def lookup(exp):
+    protocol = PROTOCOLS.get(exp)
+    if protocol is None:
+        raise ValueError('EXP number ' + str(exp) + ' is not defined')
+    return protocol
+
+# route in the dsdv tables; a routing loop ends the route before the first repeated node
+# cached until a next hop on it changes, see routing.myForest
+def dsdvPath(node,dest):
+    return node.sim.forest.route(node,dest)[0]
+
+# next hops in the dsdv table, including the node itself (own entry)
+def dsdvNbr(node):
+    nbr = set()
+    for id in node.rt.nextCount:
+        other = node.sim.getNode(id)
+        if other is not None:
+            nbr.add(other)
+    return nbr
+
+register(1,myProtocol(proactive1,reactive1,cl.catch1,cl.watch1,dsdvPath,dsdvNbr))
+register(2,myProtocol(proactive1,reactive2,cl.catch1,cl.watch1,dsdvPath,dsdvNbr))
+register(3,myProtocol(proactive1,reactive3,cl.catch1,cl.watch1,dsdvPath,dsdvNbr))
@@ -0,0 +1,117 @@
+import math
+import multiprocessing as mp
+
+import sweep as sw
+
+#
+# replicated runs with sequential stopping
+#
+# fn(seed) -> {metric: value} runs one independent replication of a scenario; like
+# sweep functions it must be a module-level function building its own simulation
+# replications are run in batches on a process pool; after each batch the running
+# mean and confidence interval of every metric is updated, and replication stops as
+# soon as all half-widths are below the target or maxRuns replications are done
+# replication i always gets sweep.pointSeed(seed,i), so results are reproducible
+#
+
+# quantile of the standard normal distribution (bisection on erf)
+def normQuantile(p):
+    lo = -10.0
+    hi = 10.0
+    for _ in range(100):
+        mid = (lo + hi)/2
+        if 0.5*(1 + math.erf(mid/math.sqrt(2))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi)/2
+
+# quantile of Student's t distribution with df degrees of freedom
+# exact closed forms for df 1 and 2; Cornish-Fisher expansion otherwise, see
+# Abramowitz & Stegun 26.7.5, within 0.2% for df >= 3
+def tQuantile(p,df):
+    if df == 1:
+        return math.tan(math.pi*(p - 0.5))
+    if df == 2:
+        return (2*p - 1)/math.sqrt(2*p*(1 - p))
+    z = normQuantile(p)
+    g1 = (z**3 + z)/4
+    g2 = (5*z**5 + 16*z**3 + 3*z)/96
+    g3 = (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/384
+    g4 = (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z)/92160
+    return z + g1/df + g2/df**2 + g3/df**3 + g4/df**4
+
+#
+# running mean and variance of a metric (Welford)
+#
+class myStat():
+    def __init__(self):
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0 # sum of squared deviations
+
+    def add(self,x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+
+    def var(self):
+        if self.n < 2:
+            return math.inf
+        return self.m2/(self.n - 1)
+
+    # half-width of the two-sided confidence interval of the mean
+    def halfWidth(self,conf=0.95):
+        if self.n < 2:
+            return math.inf
+        return tQuantile(1 - (1 - conf)/2,self.n - 1)*math.sqrt(self.var()/self.n)
+
+# worker entry; task is (fn,seed)
+def runOne(task):
+    fn,seed = task
+    return fn(seed)
+
+# run replications until every metric in target meets its half-width
+# target - {metric: half-width}, or one half-width for all metrics
+# relative - half-widths relative to |mean|
+# batch - replications per batch (default: no. of workers)
+# return ({metric: myStat}, [per replication results])
+def run(fn,target,seed=15,conf=0.95,relative=False,minRuns=3,maxRuns=100,batch=None,workers=None):
+    if workers is None:
+        workers = mp.cpu_count()
+    if batch is None:
+        batch = workers
+    stats = {}
+    results = []
+    pool = mp.Pool(workers) if workers > 1 else None
+    try:
+        while len(results) < maxRuns:
+            n = min(batch,maxRuns - len(results))
+            tasks = [(fn,sw.pointSeed(seed,len(results)+i)) for i in range(n)]
+            if pool is None:
+                done = list(map(runOne,tasks))
+            else:
+                done = pool.map(runOne,tasks)
+            for result in done:
+                results.append(result)
+                for name,value in result.items():
+                    stats.setdefault(name,myStat()).add(value)
+            if len(results) >= minRuns and converged(stats,target,conf,relative):
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return stats,results
+
+# all target metrics have a confidence interval narrower than required
+def converged(stats,target,conf=0.95,relative=False):
+    if not isinstance(target,dict):
+        target = {name: target for name in stats}
+    for name,width in target.items():
+        stat = stats[name]
+        limit = width*abs(stat.mean) if relative else width
+        if not stat.halfWidth(conf) < limit:
+            return False
+    return True
@@ -1,36 +1,112 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import glob
 import csv
-import math 
+
+# network-wide node state holding the counters of all nodes (ARRAYSTATE), None otherwise
+def nodeState(nodes):
+    if not nodes:
+        return None
+    sim = nodes[0].sim
+    if not sim.ARRAYSTATE or any(not node.STATEFUL or node.sim is not sim for node in nodes):
+        return None
+    return sim.state
+
+# per-node (pdr, ar, cr, mr) of nodes; None where undefined
+# vectorized over the node state when there is one
+def rates(nodes):
+    state = nodeState(nodes)
+    if state is not None:
+        ids = [node.id for node in nodes]
+        columns = [[None if np.isnan(x) else x for x in rate.tolist()] for rate in state.rates(ids)]
+        return list(zip(*columns))
+    result = []
+    for node in nodes:
+        pdr = ar = cr = mr = None
+        if node.pkts != 0:
+            pdr = node.arr/node.pkts
+            ar = node.atte/node.pkts
+        if node.pkts-node.atte != 0:
+            cr = node.coll/(node.pkts-node.atte)
+            mr = node.miss/(node.pkts-node.atte)
+        result.append((pdr,ar,cr,mr))
+    return result
 
 # show statistics
 def print_data(nodes):
-    for node in nodes:
-        if node.id >= 0:
-            route = node.pathTo(0)
-            routeStr = ''
-            if node.id == 0:
-                routeStr = ' destination'
-            elif route:
-                for nn in route:
-                    routeStr = routeStr + ' -> ' + str(nn.id)
-            else:
-                routeStr = ' no route'
-            print(str(node.id) + ':' + routeStr)
-            if node.pkts == 0:
-                print('PDR = NA')
-                print('Attenuation Rate = NA')
-            else:
-                print('PDR = ' + str(node.arr/node.pkts))
-                print('Attenuation Rate = ' + str(node.atte/node.pkts))
-            if node.pkts-node.atte == 0:
-                print('Collision Rate = NA')
-                print('Miss Rate = NA')
-            else:
-                print('Collision Rate = ' + str(node.coll/(node.pkts-node.atte)))
-                print('Miss Rate = ' + str(node.miss/(node.pkts-node.atte)))
-            print('Energy Consumption = ' + str(node.energy) + 'J')
-            print('\n')
+    nodes = [node for node in nodes if node.id >= 0]
+    for node,(pdr,ar,cr,mr) in zip(nodes,rates(nodes)):
+        route = node.pathTo(0)
+        routeStr = ''
+        if node.id == 0:
+            routeStr = ' destination'
+        elif route:
+            for nn in route:
+                routeStr = routeStr + ' -> ' + str(nn.id)
+        else:
+            routeStr = ' no route'
+        print(str(node.id) + ':' + routeStr)
+        if pdr is None:
+            print('PDR = NA')
+            print('Attenuation Rate = NA')
+        else:
+            print('PDR = ' + str(pdr))
+            print('Attenuation Rate = ' + str(ar))
+        if cr is None:
+            print('Collision Rate = NA')
+            print('Miss Rate = NA')
+        else:
+            print('Collision Rate = ' + str(cr))
+            print('Miss Rate = ' + str(mr))
+        print('Energy Consumption = ' + str(node.energy) + 'J')
+        print('\n')
+    # receivers left out by the k-sigma cutoff
+    if nodes and nodes[0].sim.KSIGMA is not None and nodes[0].sim.chan is not None:
+        print_cutoff(nodes[0].sim.chan)
+
+# network-wide statistics of the end devices
+# pdr/ar per generated packet, cr/mr per packet not lost to path loss, energy per node in J
+def summary(nodes):
+    state = nodeState(nodes)
+    if state is not None:
+        ids = [node.id for node in nodes if node.id > 0]
+        total = state.totals(ids,('pkts','arr','atte','coll','miss','energy'))
+        pkts = total['pkts']
+        arr = total['arr']
+        atte = total['atte']
+        coll = total['coll']
+        miss = total['miss']
+        energy = total['energy']
+        nn = len(ids)
+    else:
+        pkts = arr = atte = coll = miss = 0
+        energy = 0
+        nn = 0
+        for node in nodes:
+            if node.id > 0:
+                pkts += node.pkts
+                arr += node.arr
+                atte += node.atte
+                coll += node.coll
+                miss += node.miss
+                energy += node.energy
+                nn += 1
+    stats = {'pdr': 0, 'ar': 0, 'cr': 0, 'mr': 0, 'energy': 0}
+    if pkts != 0:
+        stats['pdr'] = arr/pkts
+        stats['ar'] = atte/pkts
+    if pkts-atte != 0:
+        stats['cr'] = coll/(pkts-atte)
+        stats['mr'] = miss/(pkts-atte)
+    if nn != 0:
+        stats['energy'] = energy/nn
+    return stats
+
+# show rx nodes pruned by the k-sigma cutoff
+def print_cutoff(chan):
+    print('Pruned Receivers = ' + str(chan.pruned))
+    print('Discarded Probability Mass <= ' + str(chan.discarded))
+    print('\n')
 
 # show topology
 def display_graph(nodes):
@@ -103,26 +179,28 @@ def save_data(nodes, filename):
     with open(filename+'.csv', 'w', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(["id", "pdr", "ar", "cr", "mr", "energy", "hops", "dist"])
-        for node in nodes:
-            if node.id == 0:
-                x0 = node.x
-                y0 = node.y
-        for node in nodes:
+        # distance to gw; from the channel cache only when it is built for this list,
+        # so that a filtered list does not replace the channel of a running simulation
+        for i in range(len(nodes)):
+            if nodes[i].id == 0:
+                chan = nodes[i].sim.chan
+                if chan is not None and chan.valid(nodes,chan.seed):
+                    dists = chan.distFrom(i)
+                else:
+                    xs = np.array([node.x for node in nodes],dtype=float)
+                    ys = np.array([node.y for node in nodes],dtype=float)
+                    dists = np.sqrt((xs[i]-xs)**2+(ys[i]-ys)**2)
+        for i,(pdr,ar,cr,mr) in enumerate(rates(nodes)):
+            node = nodes[i]
             if node.id > 0:
-                if node.pkts == 0:
+                if pdr is None:
                     pdr = 0
                     ar = 0
-                else:
-                    pdr = node.arr/node.pkts
-                    ar = node.atte/node.pkts
-                if node.pkts-node.atte == 0:
+                if cr is None:
                     cr = 0
                     mr = 0
-                else:
-                    cr = node.coll/(node.pkts-node.atte)
-                    mr = node.miss/(node.pkts-node.atte)
                 hops = len(node.pathTo(0))
-                dist = math.sqrt((node.x-x0)**2+(node.y-y0)**2)
+                dist = dists[i]
                 writer.writerow([node.id, pdr, ar, cr, mr, node.energy, hops, dist])
 
 
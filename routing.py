@@ -0,0 +1,429 @@
+import numpy as np
+from collections import OrderedDict
+
+import channel as ch
+
+#
+# next hop forest of the dsdv tables, one tree per destination
+# nodes are indexed by next hop (children), so that a next hop change drops the
+# cached routes of exactly the nodes routing through the changed node (its subtree);
+# a route and the set of ids on it are cached per (dest, node) until then, which makes
+# "is node x on the route of node y" a set lookup once the tables are stable; the
+# cache holds the CACHE most recently used routes, others are walked again
+# routing loops are followed once; every node on a loop is in the subtree of all others
+#
+class myForest():
+    CACHE = 1 << 14 # max. no. of cached routes
+
+    def __init__(self):
+        self.children = {} # dest -> {id: set of ids with that next hop}
+        self.routes = OrderedDict() # (dest, id) -> (route, set of ids on route), least recently used first
+
+    # index of the current tables of nodes; own entries are not indexed, see myRT.setRoute
+    def rebuild(self,nodes):
+        self.children = {}
+        self.routes = OrderedDict()
+        for node in nodes:
+            nextDict = node.rt.nextDict
+            for dest in nextDict.keys():
+                if dest != node.id:
+                    self.children.setdefault(dest,{}).setdefault(nextDict[dest],set()).add(node.id)
+
+    # next hop of node id to dest changed from old (None for a new dest) to next
+    def change(self,dest,id,old,next):
+        children = self.children.setdefault(dest,{})
+        if old is not None:
+            siblings = children.get(old)
+            if siblings is None or id not in siblings:
+                # entry not indexed (table filled before the forest); subtrees cannot be trusted
+                for key in [key for key in self.routes if key[0] == dest]:
+                    del self.routes[key]
+            else:
+                siblings.discard(id)
+        children.setdefault(next,set()).add(id)
+        routes = self.routes
+        if not routes:
+            return
+        stack = [id]
+        seen = {id}
+        while stack:
+            i = stack.pop()
+            routes.pop((dest,i),None)
+            for j in children.get(i,()):
+                if j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+
+    # cached (route, ids on route) of node to dest; route is [next node, ... , destination node]
+    def route(self,node,dest):
+        if dest not in node.rt.destSet:
+            return [],set()
+        routes = self.routes
+        key = (dest,node.id)
+        entry = routes.get(key)
+        if entry is not None:
+            routes.move_to_end(key)
+            return entry
+        route = []
+        seen = {node.id}
+        atNode = node
+        while atNode.id != dest:
+            next = atNode.rt.nextDict[dest]
+            nextNode = node.sim.getNode(next)
+            if nextNode is None:
+                raise ValueError('Node ' + str(atNode.id) + ' routes to unknown node ' + str(next))
+            if next in seen:
+                print('Loop Warning: route of node ' + str(node.id) + ' to ' + str(dest) + ' has a loop')
+                break
+            seen.add(next)
+            route.append(nextNode)
+            atNode = nextNode
+        seen.discard(node.id)
+        entry = (route,seen)
+        routes[key] = entry
+        if len(routes) > self.CACHE:
+            routes.popitem(last=False)
+        return entry
+
+#
+# rssi history of the neighbours of a node
+# the last window values of every neighbour are kept in a ring buffer; all buffers of
+# a node are rows of one contiguous NumPy block, grown by doubling
+# running sum, sum of squares and an exponentially weighted mean are kept per
+# neighbour, so mean, variance and ewma are O(1); the sum is recomputed in order
+# whenever a ring buffer wraps, so rounding errors do not accumulate
+#
+class myRssiHistory():
+    def __init__(self,window=25,alpha=0.1):
+        self.window = window
+        self.alpha = alpha # ewma weight of the newest value
+        self.rows = {} # neighbour id -> row
+        self.block = np.empty((4,window))
+        # per row
+        self.pos = [] # next slot
+        self.n = [] # no. of values
+        self.sum = []
+        self.sq = []
+        self.avg = [] # ewma
+
+    def __contains__(self,id):
+        return id in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    # row of a new neighbour
+    def newRow(self,id):
+        row = len(self.rows)
+        if row == self.block.shape[0]:
+            block = np.empty((2*row,self.window))
+            block[:row] = self.block
+            self.block = block
+        self.rows[id] = row
+        self.pos.append(0)
+        self.n.append(0)
+        self.sum.append(0.0)
+        self.sq.append(0.0)
+        self.avg.append(0.0)
+        return row
+
+    # record a value of neighbour id
+    def add(self,id,rssi):
+        row = self.rows.get(id)
+        if row is None:
+            row = self.newRow(id)
+        pos = self.pos[row]
+        if self.n[row] == self.window:
+            old = self.block.item(row,pos)
+            self.sum[row] -= old
+            self.sq[row] -= old*old
+            self.avg[row] += self.alpha*(rssi - self.avg[row])
+        else:
+            self.n[row] += 1
+            self.avg[row] = rssi if self.n[row] == 1 else self.avg[row] + self.alpha*(rssi - self.avg[row])
+        self.block[row,pos] = rssi
+        self.sum[row] += rssi
+        self.sq[row] += rssi*rssi
+        pos += 1
+        if pos == self.window:
+            pos = 0
+            self.sum[row] = sum(self.block[row].tolist())
+            self.sq[row] = sum(x*x for x in self.block[row].tolist())
+        self.pos[row] = pos
+
+    # fill the history of neighbour id with one value
+    def fill(self,id,rssi):
+        row = self.rows.get(id)
+        if row is None:
+            row = self.newRow(id)
+        self.block[row] = rssi
+        self.pos[row] = 0
+        self.n[row] = self.window
+        self.sum[row] = sum([rssi]*self.window)
+        self.sq[row] = sum([rssi*rssi]*self.window)
+        self.avg[row] = rssi
+
+    # no. of values of neighbour id
+    def count(self,id):
+        return self.n[self.rows[id]]
+
+    def mean(self,id):
+        row = self.rows[id]
+        return self.sum[row]/self.n[row]
+
+    # sample variance
+    def var(self,id):
+        row = self.rows[id]
+        n = self.n[row]
+        if n < 2:
+            return 0.0
+        return max(0.0,(self.sq[row] - self.sum[row]**2/n)/(n - 1))
+
+    def ewma(self,id):
+        return self.avg[self.rows[id]]
+
+    # values of neighbour id, oldest first
+    def values(self,id):
+        row = self.rows[id]
+        values = self.block[row,:self.n[row]].tolist()
+        if self.n[row] == self.window:
+            pos = self.pos[row]
+            values = values[pos:] + values[:pos]
+        return values
+
+#
+# network-wide dsdv tables in N x N arrays
+# row i holds the table of node i, column d its entry for destination d; node ids
+# must be the row indices 0..N-1; a presence mask marks the destinations in the table
+# about 13 bytes per entry instead of four Python containers per table
+# myRT of a node is a view onto its row, see myRowDict/myRowSet
+#
+class myRouteStore():
+    def __init__(self,size=16):
+        self.size = 0 # no. of rows in use
+        self.alloc(size)
+
+    def alloc(self,capacity):
+        self.capacity = capacity
+        self.has = np.zeros((capacity,capacity),dtype=bool)
+        self.next = np.full((capacity,capacity),-1,dtype=np.int32)
+        self.metric = np.zeros((capacity,capacity),dtype=np.int32)
+        self.seq = np.zeros((capacity,capacity),dtype=np.int32)
+
+    # make room for node id; capacity is doubled
+    def grow(self,id):
+        if id < self.capacity:
+            self.size = max(self.size,id+1)
+            return
+        capacity = self.capacity
+        while capacity <= id:
+            capacity *= 2
+        old = (self.has,self.next,self.metric,self.seq)
+        n = self.capacity
+        self.alloc(capacity)
+        for array,values in zip((self.has,self.next,self.metric,self.seq),old):
+            array[:n,:n] = values
+        self.size = id+1
+
+    # empty table of node id holding only its own entry
+    def reset(self,id):
+        if id < 0:
+            raise ValueError('Node ' + str(id) + ' cannot be stored in a route store')
+        self.grow(id)
+        self.has[id] = False
+        self.next[id] = -1
+        self.metric[id] = 0
+        self.seq[id] = 0
+        self.has[id,id] = True
+        self.next[id,id] = id
+
+#
+# dict view of one array of a route store restricted to the row of node id
+# keys are the destinations present in the row
+#
+class myRowDict():
+    def __init__(self,store,id,name):
+        self.store = store
+        self.id = id
+        self.name = name
+
+    def __getitem__(self,dest):
+        if not (0 <= dest < self.store.capacity and self.store.has.item(self.id,dest)):
+            raise KeyError(dest)
+        return getattr(self.store,self.name).item(self.id,dest)
+
+    def __setitem__(self,dest,value):
+        self.store.grow(dest)
+        self.store.has[self.id,dest] = True
+        getattr(self.store,self.name)[self.id,dest] = value
+
+    def __contains__(self,dest):
+        return 0 <= dest < self.store.capacity and self.store.has.item(self.id,dest)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.store.has[self.id]))
+
+    def get(self,dest,default=None):
+        if dest in self:
+            return getattr(self.store,self.name).item(self.id,dest)
+        return default
+
+    def keys(self):
+        return np.flatnonzero(self.store.has[self.id]).tolist()
+
+    def values(self):
+        return getattr(self.store,self.name)[self.id,self.store.has[self.id]].tolist()
+
+    def items(self):
+        return list(zip(self.keys(),self.values()))
+
+#
+# set view of the destinations present in the row of node id
+#
+class myRowSet():
+    def __init__(self,store,id):
+        self.store = store
+        self.id = id
+
+    def __contains__(self,dest):
+        return 0 <= dest < self.store.capacity and self.store.has.item(self.id,dest)
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self.store.has[self.id]).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.store.has[self.id]))
+
+    def add(self,dest):
+        self.store.grow(dest)
+        self.store.has[self.id,dest] = True
+
+#
+# batched dsdv merge of a beacon of txNode into the array table of rxNode
+# evaluates every destination of the beacon at once with the tests of the loops in
+# reactive1/2/3 (variant); avg/num - mean and no. of rssi values of txNode at rxNode
+# the decisions for different destinations are independent, so this gives the same
+# updates as the loops; only the loop check of reactive3 (route of txNode through
+# rxNode) is done per destination, and only for those passing all other tests
+# return accepted destinations (ascending) with their metrics and sequence numbers
+#
+def merge(txNode,rxNode,variant,avg=None,num=None):
+    store = rxNode.rt.store
+    tx = txNode.id
+    rx = rxNode.id
+    size = store.size
+    cand = store.has[tx,:size].copy()
+    if variant != 1:
+        cand[rx] = False
+    # prevent loop
+    if variant == 2:
+        cand &= store.next[tx,:size] != rx
+    dests = np.flatnonzero(cand)
+    metric = store.metric[tx,dests] + 1
+    seq = store.seq[tx,dests]
+    # existing dests
+    known = store.has[rx,dests]
+    rxMetric = store.metric[rx,dests]
+    rxSeq = store.seq[rx,dests]
+    if variant == 1:
+        ok = ~known | ~((seq < rxSeq) | (metric >= rxMetric))
+    else:
+        sim = rxNode.sim
+        ok = ~known
+        idx = np.flatnonzero(known & ~((seq < rxSeq) | (metric > sim.HL)))
+        if len(idx):
+            # rssi statistics of the current next hops
+            rec = rxNode.rt.rssiRec
+            olds = store.next[rx,dests[idx]].tolist()
+            means = {old: rec.mean(old) for old in set(olds)}
+            oldAvg = np.array([means[old] for old in olds])
+            m = metric[idx]
+            rm = rxMetric[idx]
+            # better metric and rssi not too worse, or metric not too worse and rssi significantly better
+            better = ((m < rm) & (avg > oldAvg - sim.RM1)) | ((m <= rm + 1) & (avg > oldAvg + sim.RM2))
+            if variant == 3:
+                counts = {old: rec.count(old) for old in means}
+                oldNum = np.array([counts[old] for old in olds])
+                # hysteresis only with enough samples, rssi oriented rerouting otherwise
+                better = np.where(oldNum >= 5,better,avg > oldAvg) & (num >= oldNum)
+            ok[idx] = better
+    dests = dests[ok]
+    metric = metric[ok]
+    seq = seq[ok]
+    # prevent loop
+    if variant == 3 and len(dests):
+        keep = np.array([not txNode.onPath(rxNode,dest) for dest in dests.tolist()])
+        dests = dests[keep]
+        metric = metric[keep]
+        seq = seq[keep]
+    return dests,metric,seq
+
+#
+# analytic pre-seeding of dsdv routing tables
+#
+# instead of simulating beacon convergence, routes are computed from the expected
+# link quality graph: a link is usable when its mean rssi (no shadowing) is at least
+# margin dB above the sensitivity; links are symmetric
+# every node gets a min-hop route to each destination (breadth-first search from the
+# destination, optionally limited to hl hops); among the neighbours one hop closer,
+# the strongest mean link is taken as next hop, as dsdv with rssi hysteresis
+# (RM1/RM2) settles on it; ties go to the lowest node id
+# seeded entries carry the destination's current sequence number, and the rssi
+# history of the next hop is filled with its mean rssi, so that reactive2/3 compare
+# against a converged record
+#
+
+# install a route into the routing table of node
+def install(node,dest,next,metric,seq):
+    node.rt.setRoute(dest,next,metric,seq)
+
+# mean rssi from the given tx nodes to all nodes; one row per tx node
+def meanRssi(chan,txIdx,txpow):
+    if chan.dense:
+        PL = chan.PLMat[txIdx]
+    else:
+        PL = np.array([chan.PLFrom(i) for i in txIdx])
+    return txpow + ch.GL - PL
+
+# seed routes to dest into all nodes reaching it
+# return no. of nodes without a route
+def seed(nodes,chan,dest,txpow,sens,margin=0,hl=None):
+    n = len(nodes)
+    hops = np.full(n,-1)
+    hops[dest] = 0
+    frontier = np.array([dest])
+    level = 0
+    while len(frontier) and (hl is None or level < hl):
+        level += 1
+        # strongest link from the frontier to every node not reached yet
+        best = np.full(n,-np.inf)
+        nxt = np.full(n,-1)
+        for start in range(0,len(frontier),ch.ROWS):
+            part = frontier[start:start+ch.ROWS]
+            rssi = meanRssi(chan,part,txpow)
+            rssi[:,hops >= 0] = -np.inf
+            k = rssi.argmax(axis=0)
+            r = rssi[k,np.arange(n)]
+            better = r > best
+            best[better] = r[better]
+            nxt[better] = part[k[better]]
+        frontier = np.flatnonzero(best >= sens + margin)
+        hops[frontier] = level
+        seq = nodes[dest].rt.seqDict[dest]
+        for i,j,r in zip(frontier.tolist(),nxt[frontier].tolist(),best[frontier].tolist()):
+            install(nodes[i],dest,j,level,seq)
+            nodes[i].rt.rssiRec.fill(j,r)
+    return int(np.sum(hops < 0))
+
+# converged tables of all nodes for the given destinations (default: gateway)
+# return no. of nodes without a route, summed over destinations
+def preseed(nodes,chan,txpow,sens,dests=None,margin=0,hl=None):
+    if dests is None:
+        dests = [0]
+    missing = 0
+    for dest in dests:
+        missing += seed(nodes,chan,dest,txpow,sens,margin,hl)
+    return missing
@@ -0,0 +1,128 @@
+import math
+
+import replication as rep
+import reporting as rp
+
+#
+# steady-state detection and early termination
+#
+# the simulation is run in chunks of interval ms; after each chunk the network
+# counters are sampled and the per-interval value of a metric (default: PDR,
+# arrivals over generated packets in the interval) is appended to a series
+# the warm-up transient (DSDV convergence) is located with MSER-5 and discarded,
+# the rest is split into batches whose means give a confidence interval; the run
+# ends as soon as the truncation point lies in the first half of the series and
+# the half-width meets the precision, or at time until
+# running in chunks adds no events, so the trajectory equals an uninterrupted run
+#
+
+# cumulative network counters of the end devices
+COUNTERS = ('pkts','arr','atte','coll','miss','energy')
+
+def totals(nodes):
+    state = rp.nodeState(nodes)
+    if state is not None:
+        return state.totals([node.id for node in nodes if node.id > 0],COUNTERS)
+    total = dict.fromkeys(COUNTERS,0)
+    for node in nodes:
+        if node.id > 0:
+            for name in COUNTERS:
+                total[name] += getattr(node,name)
+    return total
+
+# default metric; (numerator, denominator) of the per-interval pdr
+def pdr(total):
+    return total['arr'],total['pkts']
+
+# MSER-5 truncation point (index into series) of the warm-up transient
+# only trustworthy when it lies in the first half of the series
+def mser5(series):
+    batches = [sum(series[i:i+5])/5 for i in range(0,len(series) - len(series) % 5,5)]
+    n = len(batches)
+    if n < 2:
+        return 0
+    best = 0
+    bestStat = math.inf
+    # statistic of truncating the first d batches, keeping at least two
+    for d in range(n - 1):
+        rest = batches[d:]
+        mean = sum(rest)/len(rest)
+        stat = sum((x - mean)**2 for x in rest)/len(rest)**2
+        if stat < bestStat:
+            best = d
+            bestStat = stat
+    return 5*best
+
+# batch means of series; mean and confidence interval half-width
+def batchMeans(series,k=10,conf=0.95):
+    b = len(series)//k
+    if b == 0:
+        return math.nan,math.inf
+    series = series[len(series) - k*b:] # drop the oldest leftovers
+    stat = rep.myStat()
+    for i in range(k):
+        stat.add(sum(series[i*b:(i+1)*b])/b)
+    return stat.mean,stat.halfWidth(conf)
+
+#
+# result of a steady-state run
+#
+class mySteady():
+    def __init__(self):
+        self.times = [] # sample times
+        self.totals = [] # network counters at sample times
+        self.series = [] # per-interval metric values
+        self.seriesTimes = [] # end times of the intervals in series
+        self.warmup = 0 # end of the discarded warm-up in ms
+        self.mean = math.nan
+        self.halfWidth = math.inf
+        self.converged = False
+        self.size = 0 # no. of end devices
+
+    # network statistics after the warm-up, from the sampled counters
+    def summary(self):
+        i = self.times.index(self.warmup) if self.warmup in self.times else 0
+        total = {name: self.totals[-1][name] - self.totals[i][name] for name in COUNTERS}
+        stats = {'pdr': 0, 'ar': 0, 'cr': 0, 'mr': 0, 'energy': 0}
+        if total['pkts'] != 0:
+            stats['pdr'] = total['arr']/total['pkts']
+            stats['ar'] = total['atte']/total['pkts']
+        if total['pkts']-total['atte'] != 0:
+            stats['cr'] = total['coll']/(total['pkts']-total['atte'])
+            stats['mr'] = total['miss']/(total['pkts']-total['atte'])
+        if self.size != 0:
+            stats['energy'] = total['energy']/self.size
+        return stats
+
+# run sim until steady state is estimated with the given precision, or until time until
+# precision - half-width of the steady-state mean (relative to it with relative)
+# minSamples - no. of per-interval values before testing
+# k - no. of batches for the batch means
+def run(sim,until,interval=60*1000,precision=0.02,relative=False,metric=pdr,minSamples=30,k=10,conf=0.95):
+    result = mySteady()
+    result.size = len([node for node in sim.nodes if node.id > 0])
+    result.times.append(sim.env.now)
+    result.totals.append(totals(sim.nodes))
+    while sim.env.now < until:
+        sim.env.run(until=min(sim.env.now + interval,until))
+        if sim.EVENTMAC:
+            sim.settle()
+        total = totals(sim.nodes)
+        num0,den0 = metric(result.totals[-1])
+        num1,den1 = metric(total)
+        result.times.append(sim.env.now)
+        result.totals.append(total)
+        if den1 != den0:
+            result.series.append((num1 - num0)/(den1 - den0))
+            result.seriesTimes.append(sim.env.now)
+        n = len(result.series)
+        if n < minSamples:
+            continue
+        d = mser5(result.series)
+        result.warmup = result.seriesTimes[d-1] if d > 0 else result.times[0]
+        result.mean,result.halfWidth = batchMeans(result.series[d:],k,conf)
+        limit = precision*abs(result.mean) if relative else precision
+        if d <= n//2 and result.halfWidth < limit:
+            result.converged = True
+            break
+    return result
@@ -0,0 +1,56 @@
+import csv
+import itertools
+import multiprocessing as mp
+import numpy as np
+
+#
+# parallel parameter sweep
+#
+# every point of a grid is run by fn(point,seed) -> csv row in a process pool;
+# fn must be a module-level function building its own network.Simulation, and
+# scripts using the sweep must guard their main part with if __name__ == '__main__'
+#
+
+# deterministic seed of the i-th point of a sweep, independent of the worker running it
+def pointSeed(seed,i):
+    return int(np.random.SeedSequence(seed,spawn_key=(i,)).generate_state(1)[0])
+
+# cartesian product of parameter values as a list of dicts
+def grid(**axes):
+    names = list(axes.keys())
+    return [dict(zip(names,values)) for values in itertools.product(*axes.values())]
+
+# worker entry; task is (fn,index,point,seed)
+def runPoint(task):
+    fn,i,point,seed = task
+    return i,fn(point,seed)
+
+# run all points on workers processes (default: all cores)
+# rows are streamed into filename as runs finish; with ordered, the file is
+# rewritten in grid order once all runs are done
+# return rows in grid order
+def run(fn,points,filename,header,seed=15,workers=None,ordered=True):
+    tasks = [(fn,i,points[i],pointSeed(seed,i)) for i in range(len(points))]
+    rows = [None]*len(points)
+    with open(filename,'w',newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        file.flush()
+        if workers == 1:
+            results = map(runPoint,tasks)
+            for i,row in results:
+                rows[i] = row
+                writer.writerow(row)
+                file.flush()
+        else:
+            with mp.Pool(workers) as pool:
+                for i,row in pool.imap_unordered(runPoint,tasks):
+                    rows[i] = row
+                    writer.writerow(row)
+                    file.flush()
+    if ordered:
+        with open(filename,'w',newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+    return rows
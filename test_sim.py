@@ -0,0 +1,81 @@
+import random
+import numpy as np
+
+import network as nw
+
+#
+# regression tests; run with pytest
+#
+
+# gateway sending beacons with no node within the k-sigma cutoff radius
+def test_isolated_transmitter_cutoff_shadowseed():
+    sim = nw.Simulation(15,EXP=1,SIGMA=5,KSIGMA=3,SHADOWSEED=7)
+    sim.addNode(0,0,0).genPacket(0,25,1)
+    sim.addNode(1,100000,0)
+    sim.addNode(2,100050,0)
+    sim.start(gens=[0])
+    sim.run(30*60*1000)
+    assert sim.env.now == 30*60*1000
+    assert sim.getChannel().pruned > 0 # beacons sent, no rx node within the radius
+
+# scenario of the 600x800 topology on the module globals (compatibility shim)
+def moduleRun(until):
+    for node in nw.nodes:
+        nw.env.process(nw.transceiver(nw.env,node))
+        if node.id > 0:
+            nw.env.process(nw.generator(nw.env,node))
+    nw.env.run(until=until)
+
+def moduleNodes(exp):
+    random.seed(15)
+    nw.EXP = exp
+    nw.SIGMA = 5
+    nw.nodes = []
+    nw.env = nw.newEnv()
+    gw = nw.myNode(0,397.188492418693,226.186250701973)
+    gw.genPacket(0,25,1)
+    nw.nodes.append(gw)
+    locsN = np.loadtxt('600x800.csv',delimiter=',')
+    for i in range(locsN.shape[0]):
+        nw.nodes.append(nw.myNode(i+1,locsN[i,0],locsN[i,1]))
+
+# rebinding nw.nodes to a list of the same nodes mid-run changes nothing
+def test_module_nodes_rebound():
+    saved = nw.EXP,nw.SIGMA,nw.nodes,nw.env
+    try:
+        for exp in [1,2,3]:
+            results = []
+            for rebind in [False,True]:
+                moduleNodes(exp)
+                moduleRun(8000) # next hops still changing
+                if rebind:
+                    nw.nodes = list(nw.nodes)
+                nw.env.run(until=60*60*1000)
+                results.append([(n.arr,n.pkts,n.relay,[m.id for m in n.pathTo(0)]) for n in nw.nodes])
+            assert results[0] == results[1]
+    finally:
+        nw.EXP,nw.SIGMA,nw.nodes,nw.env = saved
+
+# scenario of the 600x800 topology as a Simulation
+def simulation(**params):
+    sim = nw.Simulation(15,SIGMA=5,PTX=12,TTL=10,n0=5,HL=5,**params)
+    sim.addNode(0,397.188492418693,226.186250701973).genPacket(0,25,1)
+    locsN = np.loadtxt('600x800.csv',delimiter=',')
+    for i in range(locsN.shape[0]):
+        sim.addNode(i+1,locsN[i,0],locsN[i,1])
+    return sim
+
+def counters(sim):
+    return [(n.arr,n.pkts,n.coll,n.miss,n.atte,n.relay,n.energy,n.rxTime,n.txTime) for n in sim.nodes]
+
+# the heap kernel runs event-for-event like simpy
+def test_heap_engine_matches_simpy():
+    for exp in [1,2,3]:
+        for eventmac in [False,True]:
+            results = []
+            for engine in ['simpy','heap']:
+                sim = simulation(EXP=exp,EVENTMAC=eventmac,ENGINE=engine)
+                sim.start()
+                sim.run(60*60*1000)
+                results.append(counters(sim))
+            assert results[0] == results[1]